@@ -0,0 +1,162 @@
+import hashlib
+import struct
+import sys
+from array import array
+from typing import Tuple
+
+from ray_ci_tracker.columnar import (
+    BUILD_COLUMNS,
+    TEST_STRING_COLUMNS,
+    StringTable,
+    TestResultTable,
+)
+
+# Binary encoding of a TestResultTable for the cache dir. It is the table's
+# own column layout written out, so decoding is a handful of bulk copies:
+#
+#   header:  magic, schema version, key (free-form string, e.g. a fingerprint)
+#   strings: lengths (uint32) followed by the utf-8 bytes of every string
+#   builds:  number of builds, one uint32 string id column per build field
+#   tests:   number of tests, build index, name/status/owner string ids,
+#            duration (float64) and flag bits (uint8) columns
+#
+# Bump SCHEMA_VERSION whenever the layout changes; older files are then
+# rejected with CacheFormatError and refetched.
+
+MAGIC = b"RCTB"
+SCHEMA_VERSION = 2
+
+_HEADER = struct.Struct("<4sHI")
+_COUNT = struct.Struct("<I")
+
+
+class CacheFormatError(ValueError):
+    pass
+
+
+def _column_bytes(column: array) -> bytes:
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _decode(data: bytes) -> str:
+    try:
+        return data.decode()
+    except UnicodeDecodeError as e:
+        raise CacheFormatError(f"corrupt string in cache file: {e}") from e
+
+
+class _Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt: struct.Struct) -> Tuple:
+        try:
+            values = fmt.unpack_from(self.data, self.offset)
+        except struct.error as e:
+            raise CacheFormatError(f"truncated cache file: {e}") from e
+        self.offset += fmt.size
+        return values
+
+    def raw(self, size: int) -> memoryview:
+        if self.offset + size > len(self.data):
+            raise CacheFormatError(
+                f"truncated cache file: {size} bytes needed at offset "
+                f"{self.offset}, {len(self.data) - self.offset} left"
+            )
+        chunk = self.data[self.offset : self.offset + size]
+        self.offset += size
+        return chunk
+
+    def done(self):
+        if self.offset != len(self.data):
+            raise CacheFormatError(
+                f"{len(self.data) - self.offset} trailing bytes in cache file"
+            )
+
+    def column(self, typecode: str, length: int) -> array:
+        column = array(typecode)
+        column.frombytes(self.raw(length * column.itemsize))
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column
+
+    def header(self) -> str:
+        magic, version, key_length = self.unpack(_HEADER)
+        if magic != MAGIC:
+            raise CacheFormatError("not a ray-ci cache file")
+        if version != SCHEMA_VERSION:
+            raise CacheFormatError(
+                f"cache schema version {version} != {SCHEMA_VERSION}"
+            )
+        return _decode(bytes(self.raw(key_length)))
+
+
+def read_key(data: bytes) -> str:
+    return _Reader(data).header()
+
+
+def encode_table(table: TestResultTable, key: str = "") -> bytes:
+    encoded_strings = [s.encode() for s in table.strings.strings]
+    key_bytes = key.encode()
+    return b"".join(
+        [
+            _HEADER.pack(MAGIC, SCHEMA_VERSION, len(key_bytes)),
+            key_bytes,
+            _COUNT.pack(len(encoded_strings)),
+            _column_bytes(array("I", [len(s) for s in encoded_strings])),
+            b"".join(encoded_strings),
+            _COUNT.pack(table.num_builds),
+            *[_column_bytes(getattr(table, column)) for column in BUILD_COLUMNS],
+            _COUNT.pack(len(table)),
+            _column_bytes(table.test_build),
+            *[_column_bytes(getattr(table, column)) for column in TEST_STRING_COLUMNS],
+            _column_bytes(table.test_duration_s),
+            _column_bytes(table.test_flags),
+        ]
+    )
+
+
+def decode_table(data: bytes) -> TestResultTable:
+    reader = _Reader(data)
+    reader.header()
+
+    (num_strings,) = reader.unpack(_COUNT)
+    lengths = reader.column("I", num_strings)
+    blob = bytes(reader.raw(sum(lengths)))
+    strings, start = [], 0
+    for length in lengths:
+        strings.append(_decode(blob[start : start + length]))
+        start += length
+
+    table = TestResultTable(StringTable(strings))
+    (num_builds,) = reader.unpack(_COUNT)
+    for column in BUILD_COLUMNS:
+        setattr(table, column, reader.column("I", num_builds))
+    (num_tests,) = reader.unpack(_COUNT)
+    table.test_build = reader.column("I", num_tests)
+    for column in TEST_STRING_COLUMNS:
+        setattr(table, column, reader.column("I", num_tests))
+    table.test_duration_s = reader.column("d", num_tests)
+    table.test_flags = reader.column("B", num_tests)
+    reader.done()
+    return table
+
+
+def table_digest(table: TestResultTable) -> str:
+    return hashlib.sha1(encode_table(table)).hexdigest()
+
+
+class TestResultTableCodec:
+    """`get_or_fetch` codec storing a TestResultTable in the binary format."""
+
+    @staticmethod
+    def encode(table: TestResultTable) -> bytes:
+        return encode_table(table)
+
+    @staticmethod
+    def decode(data: bytes) -> TestResultTable:
+        return decode_table(data)
@@ -0,0 +1,193 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ray_ci_tracker.interfaces import BuildResult
+
+FLAG_FLAKY = 1
+FLAG_STAGING = 2
+
+BUILD_COLUMNS = ("build_sha", "build_job_url", "build_os", "build_env", "build_job_id")
+TEST_STRING_COLUMNS = ("test_name", "test_status", "test_owner")
+
+
+class StringTable:
+    __slots__ = ("ids", "strings")
+
+    def __init__(self, strings: Iterable[str] = ()) -> None:
+        self.strings: List[str] = list(strings)
+        self.ids: Dict[str, int] = {s: i for i, s in enumerate(self.strings)}
+
+    def intern(self, value: str) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+def _remap(column: array, mapping: np.ndarray) -> array:
+    remapped = array("I")
+    if len(column):
+        remapped.frombytes(mapping[np.frombuffer(column, dtype=np.uint32)].tobytes())
+    return remapped
+
+
+class TestResultTable:
+    """Columnar test results of many builds.
+
+    Every string (test names, owners, statuses, build fields) is interned
+    once in `strings`; builds and tests are parallel typed arrays holding
+    string ids, so a result costs a few bytes instead of a dataclass with
+    its own dict. Parsers append to it directly and the DB writer reads the
+    columns back without materializing `TestResult` objects.
+    """
+
+    __slots__ = (
+        "strings",
+        "build_sha",
+        "build_job_url",
+        "build_os",
+        "build_env",
+        "build_job_id",
+        "test_build",
+        "test_name",
+        "test_status",
+        "test_owner",
+        "test_duration_s",
+        "test_flags",
+    )
+
+    def __init__(self, strings: Optional[StringTable] = None) -> None:
+        self.strings: StringTable = strings or StringTable()
+        # One entry per build, in the order of BUILD_COLUMNS.
+        self.build_sha: array = array("I")
+        self.build_job_url: array = array("I")
+        self.build_os: array = array("I")
+        self.build_env: array = array("I")
+        self.build_job_id: array = array("I")
+        # One entry per test result; `test_build` indexes the build columns.
+        self.test_build: array = array("I")
+        self.test_name: array = array("I")
+        self.test_status: array = array("I")
+        self.test_owner: array = array("I")
+        self.test_duration_s: array = array("d")
+        self.test_flags: array = array("B")
+
+    def __len__(self) -> int:
+        return len(self.test_name)
+
+    @property
+    def num_builds(self) -> int:
+        return len(self.build_sha)
+
+    def add_build(self, sha: str, job_url: str, os: str, build_env: str, job_id: str) -> int:
+        intern = self.strings.intern
+        for column, value in zip(BUILD_COLUMNS, (sha, job_url, os, build_env, job_id)):
+            getattr(self, column).append(intern(value))
+        return len(self.build_sha) - 1
+
+    def add_test(
+        self,
+        build: int,
+        test_name: str,
+        status: str,
+        total_duration_s: float,
+        is_labeled_flaky: bool,
+        owner: str,
+        is_labeled_staging: bool,
+    ):
+        intern = self.strings.intern
+        self.test_build.append(build)
+        self.test_name.append(intern(test_name))
+        self.test_status.append(intern(status))
+        self.test_owner.append(intern(owner))
+        self.test_duration_s.append(total_duration_s)
+        self.test_flags.append(
+            (FLAG_FLAKY if is_labeled_flaky else 0)
+            | (FLAG_STAGING if is_labeled_staging else 0)
+        )
+
+    def extend(self, other: "TestResultTable", build: Optional[int] = None):
+        """Appends all of `other`'s results.
+
+        With `build`, `other`'s own builds are ignored and its results are
+        attached to that build of this table, e.g. to assemble the results of
+        several `bazel_log.*` files of one job.
+        """
+        mapping = np.fromiter(
+            (self.strings.intern(s) for s in other.strings.strings),
+            dtype=np.uint32,
+            count=len(other.strings),
+        )
+        if build is None:
+            build_offset = self.num_builds
+            for column in BUILD_COLUMNS:
+                getattr(self, column).extend(_remap(getattr(other, column), mapping))
+            self.test_build.frombytes(
+                (np.frombuffer(other.test_build, dtype=np.uint32) + build_offset)
+                .astype(np.uint32)
+                .tobytes()
+            )
+        else:
+            self.test_build.extend(array("I", [build]) * len(other))
+        for column in TEST_STRING_COLUMNS:
+            getattr(self, column).extend(_remap(getattr(other, column), mapping))
+        self.test_duration_s.extend(other.test_duration_s)
+        self.test_flags.extend(other.test_flags)
+
+    @classmethod
+    def concat(cls, tables: Iterable["TestResultTable"]) -> "TestResultTable":
+        merged = cls()
+        for table in tables:
+            merged.extend(table)
+        return merged
+
+    @classmethod
+    def from_build_results(cls, builds: Iterable[BuildResult]) -> "TestResultTable":
+        table = cls()
+        for build in builds:
+            build_idx = table.add_build(
+                build.sha, build.job_url, build.os, build.build_env, build.job_id
+            )
+            for test in build.results:
+                table.add_test(
+                    build_idx,
+                    test.test_name,
+                    test.status,
+                    test.total_duration_s,
+                    test.is_labeled_flaky,
+                    test.owner,
+                    test.is_labeled_staging,
+                )
+        return table
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        """Yields (sha, job_url, os, build_env, job_id, test_name, status,
+        total_duration_s, is_labeled_flaky, owner, is_labeled_staging)."""
+        strings = self.strings.strings
+        builds = [
+            tuple(strings[getattr(self, column)[i]] for column in BUILD_COLUMNS)
+            for i in range(self.num_builds)
+        ]
+        for build, name, status, duration_s, flags, owner in zip(
+            self.test_build,
+            self.test_name,
+            self.test_status,
+            self.test_duration_s,
+            self.test_flags,
+            self.test_owner,
+        ):
+            yield (
+                *builds[build],
+                strings[name],
+                strings[status],
+                duration_s,
+                bool(flags & FLAG_FLAKY),
+                strings[owner],
+                bool(flags & FLAG_STAGING),
+            )
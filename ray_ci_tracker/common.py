@@ -1,20 +1,26 @@
 import asyncio
 import functools
+import hashlib
 import os
+import time
+from dataclasses import dataclass
 from datetime import datetime
 from functools import wraps
 from itertools import chain
 from pathlib import Path
 from subprocess import PIPE
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import aiofiles
 import click
 import httpx
 import ujson as json
+from dataclasses_json import DataClassJsonMixin
 from dotenv import load_dotenv
 from tqdm.asyncio import tqdm_asyncio
 
+from ray_ci_tracker.cache_format import CacheFormatError
+from ray_ci_tracker.columnar import TestResultTable
 from ray_ci_tracker.interfaces import (
     BuildkiteArtifact,
     BuildkiteStatus,
@@ -24,6 +30,7 @@ from ray_ci_tracker.interfaces import (
     TestResult,
     _parse_duration,
 )
+from ray_ci_tracker.test_metadata import TargetConfig
 
 
 def retry(func):
@@ -49,68 +56,242 @@ def run_as_sync(async_func):
     return wrapper
 
 
+@dataclass
+class CachePolicy:
+    # How long an entry that is not final yet may be served before refetching.
+    ttl_s: float = 0
+    # Whether a freshly fetched result can no longer change at the source.
+    is_final: Callable[[Any], bool] = lambda result: True
+
+
+@dataclass
+class FetchedResult:
+    """Returned by a fetch function that knows more than the cache policy."""
+
+    result: Any
+    complete: Optional[bool] = None
+    version: Optional[str] = None
+
+
+@dataclass
+class CacheMetadata(DataClassJsonMixin):
+    fetched_at_s: float
+    complete: bool
+    version: Optional[str] = None
+
+
+def _metadata_path(cache_path: Path) -> Path:
+    return cache_path.with_name(cache_path.name + ".meta.json")
+
+
+def _is_cache_fresh(
+    cache_path: Path, policy: Optional[CachePolicy], version: Optional[str]
+) -> bool:
+    metadata_path = _metadata_path(cache_path)
+    if not metadata_path.exists():
+        # Entries written before metadata existed are only trusted when the
+        # caller does not ask for freshness.
+        return policy is None and version is None
+    with open(metadata_path) as f:
+        metadata = CacheMetadata.from_json(f.read())
+    if version is not None and metadata.version != version:
+        return False
+    if metadata.complete or policy is None:
+        return True
+    return time.time() - metadata.fetched_at_s < policy.ttl_s
+
+
+async def _read_cache(cache_path: Path, result_cls, many: bool, codec):
+    if codec is not None:
+        async with aiofiles.open(cache_path, "rb") as f:
+            return codec.decode(await f.read())
+    async with aiofiles.open(cache_path) as f:
+        content = await f.read()
+        if result_cls and many:
+            loaded = json.loads(content)
+            return [result_cls.from_dict(r) for r in loaded]
+        elif result_cls and not many:
+            return result_cls.from_json(content)
+        else:
+            return json.loads(content)
+
+
+async def _write_atomically(path: Path, content, mode: str):
+    # Readers never see a partially written entry, even if the run dies.
+    tmp_path = path.with_name(path.name + ".tmp")
+    async with aiofiles.open(tmp_path, mode) as f:
+        await f.write(content)
+    os.replace(tmp_path, path)
+
+
+async def _write_cache(cache_path: Path, result, result_cls, many: bool, codec):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    if codec is not None:
+        await _write_atomically(cache_path, codec.encode(result), "wb")
+        return
+    if result_cls and many:
+        content = json.dumps([r.to_dict() for r in result])
+    elif result_cls and not many:
+        content = json.dumps(result.to_dict())
+    else:
+        content = json.dumps(result)
+    await _write_atomically(cache_path, content, "w")
+
+
 async def get_or_fetch(
-    cache_path: Path, *, use_cached: bool, result_cls, many: bool, async_func
+    cache_path: Path,
+    *,
+    use_cached: bool,
+    result_cls,
+    many: bool,
+    async_func,
+    policy: Optional[CachePolicy] = None,
+    version: Optional[str] = None,
+    codec=None,
 ):
-    if not use_cached or not cache_path.exists():
-        result = await async_func()
-        if result is None:
-            return
-        cache_path.parent.mkdir(parents=True, exist_ok=True)
-        async with aiofiles.open(cache_path, "w") as f:
-            if result_cls and many:
-                content = json.dumps([r.to_dict() for r in result])
-            elif result_cls and not many:
-                content = json.dumps(result.to_dict())
-            else:
-                content = json.dumps(result)
-            await f.write(content)
-        return result
+    if (
+        use_cached
+        and cache_path.exists()
+        and _is_cache_fresh(cache_path, policy, version)
+    ):
+        try:
+            return await _read_cache(cache_path, result_cls, many, codec)
+        except CacheFormatError as e:
+            print(f"Refetching {cache_path}: {e}")
+
+    fetched_at_s = time.time()
+    result = await async_func()
+    if isinstance(result, FetchedResult):
+        fetched = result
     else:
-        async with aiofiles.open(cache_path) as f:
-            content = await f.read()
-            if result_cls and many:
-                loaded = json.loads(content)
-                return [result_cls.from_dict(r) for r in loaded]
-            elif result_cls and not many:
-                return result_cls.from_json(content)
-            else:
-                return json.loads(content)
-
-
-def _yield_test_result(bazel_log_path):
-    # Gather the known flaky set and test owners
-    flaky_tests = set()
-    test_owners = dict()
+        fetched = FetchedResult(result)
+    result = fetched.result
+    if result is None:
+        return
+    complete = fetched.complete
+    if complete is None:
+        complete = policy.is_final(result) if policy else True
+
+    await _write_cache(cache_path, result, result_cls, many, codec)
+    await _write_atomically(
+        _metadata_path(cache_path),
+        CacheMetadata(
+            fetched_at_s=fetched_at_s,
+            complete=complete,
+            version=fetched.version or version,
+        ).to_json(),
+        "w",
+    )
+    return result
+
+
+# Only these bazel events carry data we use. Every other line (progress,
+# actions, ...) is skipped by a substring check before it gets decoded.
+_TEST_SUMMARY_MARKER = b'"testSummary"'
+_TARGET_CONFIGURED_MARKER = b'"targetConfigured"'
+_MAKE_VARIABLE_MARKER = b'"makeVariable"'
+
+_NON_TEST_TARGET_KINDS = {
+    "filegroup rule", "genrule rule",
+    "py_library rule", "py_binary rule",
+    "py_runtime rule", "py_runtime_pair rule",
+    "cc_binary rule", "cc_library rule",
+}
+
+
+def _is_test_kind(target_kind: Optional[str]) -> bool:
+    return target_kind is None or "test" in target_kind
+
+
+def _target_config(loaded, digest: str) -> Optional[TargetConfig]:
+    event_id = loaded["id"]
+    if "targetConfigured" not in event_id or "configured" not in loaded:
+        return None
+    return TargetConfig(
+        label=event_id["targetConfigured"]["label"],
+        target_kind=loaded["configured"].get("targetKind"),
+        tags=loaded["configured"].get("tag"),
+        digest=digest,
+    )
+
+
+def _collect_tags(
+    config: TargetConfig, flaky_tests: Set[str], test_owners: Dict[str, str]
+):
+    for tag in config.tags or []:
+        if tag == "flaky":
+            flaky_tests.add(config.label)
+        if tag.startswith("team:"):
+            test_owners[config.label] = tag.replace("team:", "")
+
+
+def _parse_bazel_log(
+    bazel_log_path, known_configs: Optional[Dict[str, TargetConfig]] = None
+) -> Tuple[TestResultTable, List[TargetConfig]]:
+    """Returns the results of one log, attached to a placeholder build 0, and
+    its `targetConfigured` events.
+
+    Events whose digest is in `known_configs` (see
+    `TestMetadataIndex.known_configs`) are taken from there instead of being
+    decoded again.
+    """
+    known_configs = known_configs or {}
+    configs: List[TargetConfig] = []
+    # Gather the known flaky set, test owners and summaries in a single pass;
+    # summaries are only turned into results once all tags are known.
+    flaky_tests: Set[str] = set()
+    test_owners: Dict[str, str] = dict()
     is_staging_tests = False
-    with open(bazel_log_path) as f:
+    summaries = []
+    with open(bazel_log_path, "rb") as f:
         for line in f:
+            if not (
+                _TEST_SUMMARY_MARKER in line
+                or _TARGET_CONFIGURED_MARKER in line
+                or _MAKE_VARIABLE_MARKER in line
+            ):
+                continue
+            config = None
+            digest = ""
+            if _TARGET_CONFIGURED_MARKER in line:
+                digest = hashlib.sha1(line).hexdigest()
+                config = known_configs.get(digest)
+            if config is not None:
+                configs.append(config)
+                if _is_test_kind(config.target_kind):
+                    _collect_tags(config, flaky_tests, test_owners)
+                continue
+
             loaded = json.loads(line)
-            if "configured" in loaded and "targetKind" in loaded["configured"]:
-                target_kind = loaded["configured"]["targetKind"]
-                if target_kind in {
-                    "filegroup rule", "genrule rule",
-                    "py_library rule", "py_binary rule",
-                    "py_runtime rule", "py_runtime_pair rule",
-                    "cc_binary rule", "cc_library rule",
-                }:
-                    continue
-                if not "test" in target_kind:
-                    print(f'non test target {target_kind}: {json.dumps(loaded)}')
+            event_id = loaded["id"]
+
+            if "testSummary" in loaded:
+                test_summary = loaded["testSummary"]
+                summaries.append(
+                    (
+                        event_id["testSummary"]["label"],
+                        test_summary["overallStatus"],
+                        float(test_summary["totalRunDurationMillis"]) / 1e3,
+                    )
+                )
+                continue
+
+            config = _target_config(loaded, digest)
+            if config is not None:
+                configs.append(config)
+                if not _is_test_kind(config.target_kind):
+                    if config.target_kind not in _NON_TEST_TARGET_KINDS:
+                        print(f'non test target {config.target_kind}: {json.dumps(loaded)}')
                     continue
+                if config.tags is None:
+                    print(f'could not fetch tags for test {config.label}, cannot determine if it is flaky. Raw dump: {json.dumps(loaded)}')
+                _collect_tags(config, flaky_tests, test_owners)
+                continue
+            elif "targetConfigured" in event_id:
+                print(f'could not fetch tags for test {event_id["targetConfigured"]["label"]}, cannot determine if it is flaky. Raw dump: {json.dumps(loaded)}')
 
-            if "targetConfigured" in loaded["id"]:
-                test_name = loaded["id"]["targetConfigured"]["label"]
-                if "configured" in loaded and "tag" in loaded["configured"]:
-                    for tag in loaded["configured"]["tag"]:
-                        if tag == "flaky":
-                            flaky_tests.add(test_name)
-                        if tag.startswith("team:"):
-                            test_owners[test_name] = tag.replace("team:", "")
-                else:
-                    print(f'could not fetch tags for test {test_name}, cannot determine if it is flaky. Raw dump: {json.dumps(loaded)}')
             if (
-                "configuration" in loaded["id"]
+                "configuration" in event_id
                 and "makeVariable" in loaded["configuration"]
             ):
                 if (
@@ -119,28 +300,24 @@ def _yield_test_result(bazel_log_path):
                 ):
                     is_staging_tests = True
 
-    with open(bazel_log_path) as f:
-        for line in f:
-            loaded = json.loads(line)
-            if "testSummary" in loaded:
-                test_summary = loaded["testSummary"]
-
-                name = loaded["id"]["testSummary"]["label"]
-                status = test_summary["overallStatus"]
-                if status in {"FAILED", "TIMEOUT", "NO_STATUS"}:
-                    status = "FAILED"
-                duration_s = float(test_summary["totalRunDurationMillis"]) / 1e3
-                yield TestResult(
-                    name + (" (staging)" if is_staging_tests else ""),
-                    status,
-                    duration_s,
-                    name in flaky_tests,
-                    test_owners.get(name, "unknown"),
-                    is_staging_tests,
-                )
+    table = TestResultTable()
+    for name, status, duration_s in summaries:
+        if status in {"FAILED", "TIMEOUT", "NO_STATUS"}:
+            status = "FAILED"
+        table.add_test(
+            0,
+            name + (" (staging)" if is_staging_tests else ""),
+            status,
+            duration_s,
+            name in flaky_tests,
+            test_owners.get(name, "unknown"),
+            is_staging_tests,
+        )
+    return table, configs
 
 
-def _process_single_build(dir_name) -> Optional[BuildResult]:
+def _read_build_metadata(dir_name) -> Optional[BuildResult]:
+    """Returns the build described by `metadata.json`, without test results."""
     metadata_path = dir_name / "metadata.json"
     if not os.path.exists(dir_name / "metadata.json"):
         return None
@@ -161,9 +338,28 @@ def _process_single_build(dir_name) -> Optional[BuildResult]:
         os=os_name,
         build_env=metadata["build_config"]["config"]["env"],
         job_id=os.path.split(dir_name)[-1],
-        results=list(
-            chain.from_iterable(
-                _yield_test_result(log) for log in dir_name.glob("bazel_log.*")
-            )
-        ),
+        results=[],
+    )
+
+
+def _bazel_logs(dir_name) -> List[Path]:
+    return sorted(dir_name.glob("bazel_log.*"))
+
+
+def _assemble_build(build: BuildResult, log_tables: List[TestResultTable]):
+    table = TestResultTable()
+    build_idx = table.add_build(
+        build.sha, build.job_url, build.os, build.build_env, build.job_id
+    )
+    for log_table in log_tables:
+        table.extend(log_table, build=build_idx)
+    return table
+
+
+def _process_single_build(dir_name) -> Optional[TestResultTable]:
+    build = _read_build_metadata(dir_name)
+    if build is None:
+        return None
+    return _assemble_build(
+        build, [_parse_bazel_log(log)[0] for log in _bazel_logs(dir_name)]
     )
@@ -11,7 +11,13 @@ import aiofiles
 import httpx
 from tqdm.asyncio import tqdm_asyncio
 
-from ray_ci_tracker.common import _process_single_build, get_or_fetch, retry
+from ray_ci_tracker.common import (
+    CachePolicy,
+    _process_single_build,
+    get_or_fetch,
+    retry,
+)
+from ray_ci_tracker.http_client import HTTPClientPool
 from ray_ci_tracker.interfaces import (
     BuildkiteArtifact,
     BuildkiteStatus,
@@ -68,6 +74,43 @@ query ReleaseTestQuery {
 }
 """
 
+BUILDKITE_GRAPHQL_URL = "https://graphql.buildkite.com/v1"
+BUILDKITE_API_URL = "https://api.buildkite.com"
+
+BUILDKITE_TERMINAL_JOB_STATES = {
+    "FINISHED",
+    "CANCELED",
+    "TIMED_OUT",
+    "SKIPPED",
+    "BROKEN",
+    "EXPIRED",
+}
+
+
+def _jobs_in_resp(resp_json: dict):
+    for build in resp_json["data"]["pipeline"]["builds"]["edges"]:
+        for job in build["node"]["jobs"]["edges"]:
+            if job["node"] != {}:
+                yield job["node"]
+
+
+# Job listings keep changing until every job reached a terminal state.
+JOB_STATUS_CACHE_POLICY = CachePolicy(
+    ttl_s=60 * 60,
+    is_final=lambda resp_json: all(
+        job["state"] in BUILDKITE_TERMINAL_JOB_STATES
+        for job in _jobs_in_resp(resp_json)
+    ),
+)
+# Parsing is local, so a parse of a non-final listing is always redone.
+PARSED_STATUS_CACHE_POLICY = CachePolicy(
+    ttl_s=0,
+    is_final=lambda statuses: all(
+        status.state in BUILDKITE_TERMINAL_JOB_STATES for status in statuses
+    ),
+)
+ARTIFACT_CACHE_POLICY = CachePolicy()
+
 
 def _map_status(status: str) -> str:
     if status in {"finished", "success"}:
@@ -77,7 +120,9 @@ def _map_status(status: str) -> str:
 
 class BuildkiteReleaseSource:
     @staticmethod
-    async def fetch_all(cache_path: Path, cached_buildkite, commits):
+    async def fetch_all(
+        cache_path: Path, cached_buildkite, commits, clients: HTTPClientPool
+    ):
         print("Downloading Buildkite Status (Jobs)")
         concurrency_limiter = asyncio.Semaphore(5)
         buildkite_jsons = await tqdm_asyncio.gather(
@@ -91,7 +136,9 @@ class BuildkiteReleaseSource:
                         BuildkiteReleaseSource.get_buildkite_job_status,
                         commit_sha=commit.sha,
                         concurrency_limiter=concurrency_limiter,
+                        http_client=clients.get(BUILDKITE_GRAPHQL_URL),
                     ),
+                    policy=JOB_STATUS_CACHE_POLICY,
                 )
                 for commit in commits
             ]
@@ -107,6 +154,7 @@ class BuildkiteReleaseSource:
                         BuildkiteReleaseSource.parse_buildkite_build_json,
                         resp_json,
                     ),
+                    policy=PARSED_STATUS_CACHE_POLICY,
                 )
                 for commit, resp_json in zip(commits, buildkite_jsons)
             ]
@@ -126,7 +174,9 @@ class BuildkiteReleaseSource:
                         dir_prefix=cache_path,
                         artifacts=status.artifacts,
                         concurrency_limiter=asyncio.Semaphore(5),
+                        http_client=clients.get(BUILDKITE_API_URL),
                     ),
+                    policy=ARTIFACT_CACHE_POLICY,
                 )
                 for status in chain.from_iterable(buildkite_parsed)
                 if len(status.artifacts) > 0
@@ -138,68 +188,61 @@ class BuildkiteReleaseSource:
     @staticmethod
     @retry
     async def get_buildkite_job_status(
-        commit_sha, concurrency_limiter: asyncio.Semaphore
+        commit_sha,
+        concurrency_limiter: asyncio.Semaphore,
+        http_client: httpx.AsyncClient,
     ) -> Dict:
         async with concurrency_limiter:
-            http_client = httpx.AsyncClient(timeout=httpx.Timeout(60))
-            async with http_client:
-                resp = await http_client.post(
-                    "https://graphql.buildkite.com/v1",
-                    headers={"Authorization": f"Bearer {os.environ['BUILDKITE_TOKEN']}"},
-                    json={"query": GRAPHQL_QUERY.replace("COMMIT_PLACEHODLER", commit_sha)},
-                )
-                resp.raise_for_status()
-                return resp.json()
+            resp = await http_client.post(
+                BUILDKITE_GRAPHQL_URL,
+                headers={"Authorization": f"Bearer {os.environ['BUILDKITE_TOKEN']}"},
+                json={"query": GRAPHQL_QUERY.replace("COMMIT_PLACEHODLER", commit_sha)},
+            )
+            resp.raise_for_status()
+            return resp.json()
 
     @staticmethod
     async def parse_buildkite_build_json(
         resp_json: dict,
     ) -> List[BuildkiteStatus]:
-        builds = resp_json["data"]["pipeline"]["builds"]["edges"]
-
         statuses = []
-        for build in builds:
-            jobs = build["node"]["jobs"]["edges"]
-            for job in jobs:
-                actual_job = job["node"]
-                if actual_job == {}:
-                    continue
-                job_id = actual_job["uuid"]
-                sha = actual_job["build"]["commit"]
-                build_id = str(actual_job["build"]["number"])
+        for actual_job in _jobs_in_resp(resp_json):
+            job_id = actual_job["uuid"]
+            sha = actual_job["build"]["commit"]
+            build_id = str(actual_job["build"]["number"])
 
-                artifacts = []
-                for artifact in actual_job["artifacts"]["edges"]:
-                    url = artifact["node"]["downloadURL"]
-                    path = artifact["node"]["path"]
-                    if ".json" in path:
-                        filename = os.path.split(path)[1]
-                        on_disk_path = (
-                            f"release_test_json/master/{sha}/{job_id}/{filename}"
-                        )
-                        artifacts.append(
-                            BuildkiteArtifact(
-                                url=url,
-                                bazel_events_path=on_disk_path,
-                                id=artifact["node"]["uuid"],
-                                job_id=job_id,
-                                build_id=build_id,
-                                sha=sha,
-                            )
+            artifacts = []
+            for artifact in actual_job["artifacts"]["edges"]:
+                url = artifact["node"]["downloadURL"]
+                path = artifact["node"]["path"]
+                if ".json" in path:
+                    filename = os.path.split(path)[1]
+                    on_disk_path = (
+                        f"release_test_json/master/{sha}/{job_id}/{filename}"
+                    )
+                    artifacts.append(
+                        BuildkiteArtifact(
+                            url=url,
+                            bazel_events_path=on_disk_path,
+                            id=artifact["node"]["uuid"],
+                            job_id=job_id,
+                            build_id=build_id,
+                            sha=sha,
                         )
+                    )
 
-                status = BuildkiteStatus(
-                    job_id=job_id,
-                    label=actual_job["label"],
-                    passed=actual_job["passed"],
-                    state=actual_job["state"],
-                    url=actual_job["url"],
-                    commit=sha,
-                    startedAt=actual_job["startedAt"],
-                    finished_at=actual_job["finishedAt"],
-                    artifacts=artifacts,
-                )
-                statuses.append(status)
+            status = BuildkiteStatus(
+                job_id=job_id,
+                label=actual_job["label"],
+                passed=actual_job["passed"],
+                state=actual_job["state"],
+                url=actual_job["url"],
+                commit=sha,
+                startedAt=actual_job["startedAt"],
+                finished_at=actual_job["finishedAt"],
+                artifacts=artifacts,
+            )
+            statuses.append(status)
         return statuses
 
     @staticmethod
@@ -208,37 +251,37 @@ class BuildkiteReleaseSource:
         dir_prefix: Path,
         artifacts: List[BuildkiteArtifact],
         concurrency_limiter: asyncio.Semaphore,
+        http_client: httpx.AsyncClient,
     ) -> Optional[BuildResult]:
         assert len(artifacts)
 
         bazel_events_dir = None
         async with concurrency_limiter:
-            async with httpx.AsyncClient(timeout=60) as client:
-                for artifact in artifacts:
-                    path = dir_prefix / artifact.bazel_events_path
+            for artifact in artifacts:
+                path = dir_prefix / artifact.bazel_events_path
 
-                    path.parent.mkdir(exist_ok=True, parents=True)
-                    bazel_events_dir = path.parent
+                path.parent.mkdir(exist_ok=True, parents=True)
+                bazel_events_dir = path.parent
 
-                    artifact_url = (
-                        "https://api.buildkite.com/v2/organizations/ray-project" +
-                        "/pipelines/release-tests-branch" +
-                        "/builds/" + artifact.build_id +
-                        "/jobs/" + artifact.job_id +
-                        "/artifacts/" + artifact.id + "/download"
-                    )
+                artifact_url = (
+                    BUILDKITE_API_URL + "/v2/organizations/ray-project" +
+                    "/pipelines/release-tests-branch" +
+                    "/builds/" + artifact.build_id +
+                    "/jobs/" + artifact.job_id +
+                    "/artifacts/" + artifact.id + "/download"
+                )
 
-                    async with client.stream(
-                        "GET", artifact_url, follow_redirects=True,
-                        headers={"Authorization": f"Bearer {os.environ['BUILDKITE_TOKEN']}"},
-                    ) as response:
-                        if response.status_code == 404:
-                            print(dir_prefix, artifact, 404)
-                            continue
-                        response.raise_for_status()
-                        async with aiofiles.open(path, "wb") as f:
-                            async for chunk in response.aiter_bytes():
-                                await f.write(chunk)
+                async with http_client.stream(
+                    "GET", artifact_url, follow_redirects=True,
+                    headers={"Authorization": f"Bearer {os.environ['BUILDKITE_TOKEN']}"},
+                ) as response:
+                    if response.status_code == 404:
+                        print(dir_prefix, artifact, 404)
+                        continue
+                    response.raise_for_status()
+                    async with aiofiles.open(path, "wb") as f:
+                        async for chunk in response.aiter_bytes():
+                            await f.write(chunk)
 
         assert bazel_events_dir is not None
         if not os.path.exists(os.path.join(bazel_events_dir, "result.json")):
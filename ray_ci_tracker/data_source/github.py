@@ -9,19 +9,27 @@ import httpx
 from dotenv import load_dotenv
 from tqdm.asyncio import tqdm_asyncio
 
-from ray_ci_tracker.common import get_or_fetch
+from ray_ci_tracker.common import CachePolicy, get_or_fetch
+from ray_ci_tracker.http_client import HTTPClientPool
 from ray_ci_tracker.interfaces import GHAJobStat, GHCommit, _parse_duration
 
 load_dotenv()
 
 GH_HEADERS = {"Authorization": f"token {os.environ['GITHUB_TOKEN']}"}
+GH_API_URL = "https://api.github.com"
+
+# The commit window moves with every push to master, so the listing is never
+# final; it only has to stay stable between `download` and `etl` of one run.
+COMMITS_CACHE_POLICY = CachePolicy(ttl_s=30 * 60, is_final=lambda commits: False)
+# Check suites are only cached once they completed.
+GHA_CACHE_POLICY = CachePolicy()
 
 
 class GithubDataSource:
     @staticmethod
-    async def _get_latest_commit() -> List[GHCommit]:
-        resp = httpx.get(
-            "https://api.github.com/repos/ray-project/ray/commits?per_page=80",
+    async def _get_latest_commit(http_client: httpx.AsyncClient) -> List[GHCommit]:
+        resp = await http_client.get(
+            f"{GH_API_URL}/repos/ray-project/ray/commits?per_page=80",
             headers=GH_HEADERS,
         )
         assert resp.status_code == 200, "Pinging github API /commits failed"
@@ -44,18 +52,29 @@ class GithubDataSource:
         ]
 
     @staticmethod
-    async def fetch_commits(cache_path: Path, cached_github: bool) -> List[GHCommit]:
+    async def fetch_commits(
+        cache_path: Path, cached_github: bool, clients: HTTPClientPool
+    ) -> List[GHCommit]:
         commits: List[GHCommit] = await get_or_fetch(
             cache_path / "github_commits.json",
             use_cached=cached_github,
             result_cls=GHCommit,
             many=True,
-            async_func=GithubDataSource._get_latest_commit,
+            async_func=functools.partial(
+                GithubDataSource._get_latest_commit,
+                http_client=clients.get(GH_API_URL),
+            ),
+            policy=COMMITS_CACHE_POLICY,
         )
         return commits
 
     @staticmethod
-    async def fetch_all(cache_path: Path, cached_gha: bool, commits: List[GHCommit]):
+    async def fetch_all(
+        cache_path: Path,
+        cached_gha: bool,
+        commits: List[GHCommit],
+        clients: HTTPClientPool,
+    ):
         concurrency_limiter = asyncio.Semaphore(5)
         gha_status_raw: List[Optional[GHAJobStat]] = await tqdm_asyncio.gather(
             *[
@@ -68,7 +87,9 @@ class GithubDataSource:
                         GithubDataSource.get_gha_status,
                         sha=commit.sha,
                         concurrency_limiter=concurrency_limiter,
+                        http_client=clients.get(GH_API_URL),
                     ),
+                    policy=GHA_CACHE_POLICY,
                 )
                 for commit in commits
             ]
@@ -78,7 +99,9 @@ class GithubDataSource:
 
     @staticmethod
     async def get_gha_status(
-        sha: str, concurrency_limiter: asyncio.Semaphore
+        sha: str,
+        concurrency_limiter: asyncio.Semaphore,
+        http_client: httpx.AsyncClient,
     ) -> Optional[GHAJobStat]:
         GITHUB_TO_BAZEL_STATUS_MAP = {
             "action_required": None,
@@ -92,35 +115,34 @@ class GithubDataSource:
         }
 
         async with concurrency_limiter:
-            async with httpx.AsyncClient() as client:
-                data = (
-                    await client.get(
-                        f"https://api.github.com/repos/ray-project/ray/commits/{sha}/check-suites",
-                        headers=GH_HEADERS,
-                    )
-                ).json()
+            data = (
+                await http_client.get(
+                    f"{GH_API_URL}/repos/ray-project/ray/commits/{sha}/check-suites",
+                    headers=GH_HEADERS,
+                )
+            ).json()
 
-                if "check_suites" not in data:
-                    return None
+            if "check_suites" not in data:
+                return None
 
-                for check in data["check_suites"]:
-                    slug = check["app"]["slug"]
-                    if slug == "github-actions" and check["status"] == "completed":
-                        data = (
-                            await client.get(check["check_runs_url"], headers=GH_HEADERS)
-                        ).json()
-                        if len(data.get("check_runs", [])) == 0:
-                            return None
-                        run = data["check_runs"][0]
-                        return GHAJobStat(
-                            job_id=run["id"],
-                            os="windows",
-                            commit=sha,
-                            env="github action main job",
-                            state=GITHUB_TO_BAZEL_STATUS_MAP[check["conclusion"]],
-                            url=run["html_url"],
-                            duration_s=_parse_duration(
-                                run.get("started_at"), run.get("completed_at")
-                            ),
-                        )
+            for check in data["check_suites"]:
+                slug = check["app"]["slug"]
+                if slug == "github-actions" and check["status"] == "completed":
+                    data = (
+                        await http_client.get(check["check_runs_url"], headers=GH_HEADERS)
+                    ).json()
+                    if len(data.get("check_runs", [])) == 0:
+                        return None
+                    run = data["check_runs"][0]
+                    return GHAJobStat(
+                        job_id=run["id"],
+                        os="windows",
+                        commit=sha,
+                        env="github action main job",
+                        state=GITHUB_TO_BAZEL_STATUS_MAP[check["conclusion"]],
+                        url=run["html_url"],
+                        duration_s=_parse_duration(
+                            run.get("started_at"), run.get("completed_at")
+                        ),
+                    )
         return None
@@ -1,108 +1,175 @@
 import asyncio
 import functools
 import os
-from itertools import chain
+from itertools import islice
 from pathlib import Path
-from subprocess import PIPE
-import sys
-from typing import List
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple
 
 from tqdm.asyncio import tqdm_asyncio
 
-from ray_ci_tracker.common import _process_single_build, get_or_fetch
-from ray_ci_tracker.interfaces import BuildResult, GHCommit
+from ray_ci_tracker.cache_format import TestResultTableCodec
+from ray_ci_tracker.common import FetchedResult, get_or_fetch
+from ray_ci_tracker.columnar import TestResultTable
+from ray_ci_tracker.interfaces import GHCommit
+from ray_ci_tracker.manifest import SyncManifest
+from ray_ci_tracker.parallel import ParseStage
+from ray_ci_tracker.s3_client import AsyncS3Client
 
 # Commits that are known to be bad, often has bazel build logs that are too
 # large to sync down.
 _COMMIT_BLACKLIST = []
 
+# Bazel event logs above this size are not worth syncing down.
+_MAX_OBJECT_SIZE_BYTES = 100_000_000
+
 
 class S3DataSource:
     @staticmethod
-    async def fetch_all(cache_path: Path, cached_s3: bool, commits: List[GHCommit]):
-        concurrency_limiter = asyncio.Semaphore(10)
+    async def fetch_all(
+        cache_path: Path,
+        cached_s3: bool,
+        commits: List[GHCommit],
+        s3_client: AsyncS3Client,
+        parse_stage: ParseStage,
+        manifest: Optional[SyncManifest] = None,
+    ) -> TestResultTable:
+        return TestResultTable.concat(
+            await S3DataSource.fetch_by_commit(
+                cache_path, cached_s3, commits, s3_client, parse_stage, manifest
+            )
+        )
 
-        bazel_events = await tqdm_asyncio.gather(
+    @staticmethod
+    async def fetch_by_commit(
+        cache_path: Path,
+        cached_s3: bool,
+        commits: List[GHCommit],
+        s3_client: AsyncS3Client,
+        parse_stage: ParseStage,
+        manifest: Optional[SyncManifest] = None,
+    ) -> List[TestResultTable]:
+        """Results of each of `commits`, in the same order."""
+        return await tqdm_asyncio.gather(
             *[
-                get_or_fetch(
-                    cache_path / f"bazel_cached/{commit.sha}/cached_result.json",
-                    use_cached=cached_s3,
-                    result_cls=BuildResult,
-                    many=True,
-                    async_func=functools.partial(
-                        S3DataSource._get_bazel_events_s3,
-                        commit=commit.sha,
-                        bucket="ray-travis-logs",
-                        s3_path=f"bazel_events/master/{commit.sha}",
-                        download_dir=cache_path / f"bazel_events/master/{commit.sha}",
-                        concurrency_limiter=concurrency_limiter,
-                    ),
+                S3DataSource._fetch_commit(
+                    cache_path, cached_s3, commit, s3_client, parse_stage, manifest
                 )
                 for commit in commits
             ]
         )
-        return list(chain.from_iterable(bazel_events))
 
     @staticmethod
-    async def _get_bazel_events_s3(
-        commit, bucket, s3_path, download_dir, concurrency_limiter: asyncio.Semaphore
-    ) -> List[BuildResult]:
-        if commit in _COMMIT_BLACKLIST:
-            return []
-        
-        os.makedirs(download_dir, exist_ok=True)
-
-        async with concurrency_limiter:
-            ls_proc = await asyncio.subprocess.create_subprocess_shell(
-                f"aws s3 ls --recursive s3://{bucket}/{s3_path}",
-                shell=True,
-                stdout=PIPE,
-                stderr=PIPE,
-            )
+    async def iter_by_commit(
+        cache_path: Path,
+        cached_s3: bool,
+        commits: List[GHCommit],
+        s3_client: AsyncS3Client,
+        parse_stage: ParseStage,
+        manifest: Optional[SyncManifest] = None,
+        max_pending: int = 8,
+    ) -> AsyncIterator[Tuple[GHCommit, TestResultTable]]:
+        """Yields (commit, results) as soon as each commit is fetched.
 
-            objects, stderr = await ls_proc.communicate()
-            if stderr:
-                print(stderr.decode("utf-8"))
-            elif ls_proc.returncode != 0 and not objects.strip():
-                print(f"List object for {s3_path} returned nothing; exit code {ls_proc.returncode}")
-                return []
+        At most `max_pending` commits are in flight, so only their results
+        are held in memory no matter how many commits there are.
+        """
+        remaining = iter(commits)
+        pending: Dict[asyncio.Future, GHCommit] = {}
+        try:
+            with tqdm_asyncio(total=len(commits)) as progress:
+                while True:
+                    for commit in islice(remaining, max_pending - len(pending)):
+                        fetch = S3DataSource._fetch_commit(
+                            cache_path,
+                            cached_s3,
+                            commit,
+                            s3_client,
+                            parse_stage,
+                            manifest,
+                        )
+                        pending[asyncio.ensure_future(fetch)] = commit
+                    if not pending:
+                        return
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        progress.update()
+                        yield pending.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
-            assert ls_proc.returncode == 0
+    @staticmethod
+    def _fetch_commit(
+        cache_path: Path,
+        cached_s3: bool,
+        commit: GHCommit,
+        s3_client: AsyncS3Client,
+        parse_stage: ParseStage,
+        manifest: Optional[SyncManifest],
+    ) -> Awaitable[TestResultTable]:
+        return get_or_fetch(
+            cache_path / f"bazel_cached/{commit.sha}/cached_result.bin",
+            # Commits the manifest still tracks are synced again; the others
+            # are served from the cache unless it holds a different listing.
+            # Without a manifest (e.g. in `etl`) nothing is synced, so
+            # whatever `download` cached last is served as is.
+            use_cached=cached_s3
+            and (manifest is None or not manifest.needs_sync(commit)),
+            result_cls=TestResultTable,
+            many=False,
+            codec=TestResultTableCodec,
+            async_func=functools.partial(
+                S3DataSource._get_bazel_events_s3,
+                commit=commit,
+                bucket="ray-travis-logs",
+                s3_path=f"bazel_events/master/{commit.sha}",
+                download_dir=cache_path / f"bazel_events/master/{commit.sha}",
+                job_cache_dir=cache_path / f"bazel_cached/{commit.sha}/jobs",
+                s3_client=s3_client,
+                parse_stage=parse_stage,
+                manifest=manifest,
+            ),
+            version=manifest.listing_digest(commit.sha) if manifest else None,
+        )
 
-            lines = objects.decode("utf-8").splitlines()
+    @staticmethod
+    async def _get_bazel_events_s3(
+        commit: GHCommit,
+        bucket,
+        s3_path,
+        download_dir,
+        job_cache_dir: Path,
+        s3_client: AsyncS3Client,
+        parse_stage: ParseStage,
+        manifest: Optional[SyncManifest],
+    ) -> FetchedResult:
+        if commit.sha in _COMMIT_BLACKLIST:
+            return FetchedResult(TestResultTable(), complete=True)
 
-            exclude = []
-            for line in lines:
-                # Trim the leading date-time
-                line = line[len("2020-01-01 00:00:00 "):].strip()
-                fields = line.split()
-                if len(fields) != 2:
-                    print(f"Unexpected line: {line}")
-                    continue
-                size = int(fields[0])
-                object_key = fields[1]
-                if object_key.endswith("/"):
-                    continue
-                if size > 100000000:
-                    print(f"Skipping {object_key} because it's too large: {size}")
-                    exclude.append(object_key)
+        os.makedirs(download_dir, exist_ok=True)
 
-            cmd = f"aws s3 sync s3://{bucket}/{s3_path} {download_dir}"
-            for obj in exclude:
-                cmd += f" --exclude {obj[len(s3_path)+1:]}"
-            proc = await asyncio.subprocess.create_subprocess_shell(
-                cmd,
-                shell=True,
-                stdout=PIPE,
-                stderr=PIPE,
-            )
-            _, stderr = await proc.communicate()
-            if stderr:
-                print(stderr.decode("utf-8"))
-            assert proc.returncode == 0
+        objects = await s3_client.sync(
+            bucket, s3_path, download_dir, max_object_size=_MAX_OBJECT_SIZE_BYTES
+        )
+        complete = False
+        version = None
+        if manifest is not None:
+            version = manifest.record(commit, objects).listing_digest
+            complete = not manifest.needs_sync(commit)
+        if not objects:
+            print(f"List object for {s3_path} returned nothing")
+            return FetchedResult(TestResultTable(), complete=complete, version=version)
 
-        lst = [
-            _process_single_build(Path(download_dir) / build)
-            for build in os.listdir(download_dir)
-        ]
-        return [item for item in lst if item is not None]
+        # Parsing happens off the event loop, so other commits keep downloading.
+        # Only job directories whose files changed since the last run are parsed.
+        builds = await parse_stage.submit(
+            [Path(download_dir) / build for build in sorted(os.listdir(download_dir))],
+            job_cache_dir,
+        )
+        return FetchedResult(
+            builds,
+            complete=complete,
+            version=version,
+        )
@@ -0,0 +1,102 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Dict
+
+import httpx
+import ujson as json
+from tqdm.asyncio import tqdm_asyncio
+
+from ray_ci_tracker.s3_client import AsyncS3Client, S3Object
+
+TEST_STATE_BUCKET = "ray-ci-results"
+TEST_STATE_PREFIX = "ray_tests/"
+
+
+def test_state_key(test_name: str) -> str:
+    return test_name.replace("/", "_")
+
+
+class TestStateSource:
+    @staticmethod
+    def _index_path(cache_path: Path) -> Path:
+        return cache_path / "test_state.json"
+
+    @staticmethod
+    def _load_index(cache_path: Path) -> Dict[str, Dict[str, str]]:
+        index_path = TestStateSource._index_path(cache_path)
+        if not index_path.exists():
+            return {}
+        with open(index_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    async def fetch_all(
+        cache_path: Path,
+        use_cached: bool,
+        s3_client: AsyncS3Client,
+        max_concurrency: int = 50,
+    ) -> Dict[str, str]:
+        """Returns test name (as keyed in `ray_tests/`) -> flaky state.
+
+        The index persisted in the cache dir remembers the ETag of every
+        object, so a refresh lists the prefix once and only downloads objects
+        that changed since the last run.
+        """
+        index = TestStateSource._load_index(cache_path)
+        if use_cached and index:
+            return {name: entry["state"] for name, entry in index.items()}
+
+        objects = [
+            obj
+            async for obj in s3_client.list_objects(
+                TEST_STATE_BUCKET, TEST_STATE_PREFIX
+            )
+            if obj.key.endswith(".json")
+        ]
+        changed = [
+            obj
+            for obj in objects
+            if index.get(TestStateSource._name(obj), {}).get("etag") != obj.etag
+        ]
+        print(f"Fetching {len(changed)}/{len(objects)} changed test states")
+
+        concurrency_limiter = asyncio.Semaphore(max_concurrency)
+        fetched = await tqdm_asyncio.gather(
+            *[
+                TestStateSource._get_test_state(s3_client, obj, concurrency_limiter)
+                for obj in changed
+            ]
+        )
+
+        listed = {TestStateSource._name(obj) for obj in objects}
+        index = {name: entry for name, entry in index.items() if name in listed}
+        for obj, state in zip(changed, fetched):
+            if state is not None:
+                index[TestStateSource._name(obj)] = {"etag": obj.etag, "state": state}
+
+        index_path = TestStateSource._index_path(cache_path)
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+        return {name: entry["state"] for name, entry in index.items()}
+
+    @staticmethod
+    def _name(obj: S3Object) -> str:
+        return obj.key[len(TEST_STATE_PREFIX) : -len(".json")]
+
+    @staticmethod
+    async def _get_test_state(
+        s3_client: AsyncS3Client,
+        obj: S3Object,
+        concurrency_limiter: asyncio.Semaphore,
+    ):
+        async with concurrency_limiter:
+            try:
+                data = await s3_client.get_bytes(TEST_STATE_BUCKET, obj.key)
+            except httpx.HTTPError as e:
+                print(f"Failed to get test state for {obj.key}: {e}")
+                return None
+        return json.loads(data).get("state", "passing")
@@ -1,14 +1,32 @@
 from collections import defaultdict
+from contextlib import contextmanager
 import dataclasses
-from itertools import chain
+from itertools import chain, islice
 from sqlite3 import connect
-from typing import List, Optional
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
-import boto3
 import numpy as np
 import ujson as json
-from botocore.exceptions import ClientError
 
+from ray_ci_tracker.columnar import (
+    BUILD_COLUMNS,
+    FLAG_FLAKY,
+    FLAG_STAGING,
+    TestResultTable,
+)
+from ray_ci_tracker.data_source.test_state import test_state_key
 from ray_ci_tracker.interfaces import (
     BuildkitePRBuildTime,
     BuildkiteStatus,
@@ -19,52 +37,304 @@ from ray_ci_tracker.interfaces import (
     SiteStatItem,
     SiteTravisLink,
 )
+from ray_ci_tracker.test_metadata import test_label
+
+
+# Bump whenever the schema changes, existing DBs are then rebuilt.
+SCHEMA_VERSION = 2
+
+# Built after the rows are in when bulk loading, see ResultsDBWriter.bulk_load.
+_INDEXES = {
+    "results_hot_path_test_id": "results (test_id, commit_id)",
+    "results_hot_path_job_id": "results (job_id)",
+}
+
+# Rows per executemany, bounds the memory used for a single insert.
+_INSERT_CHUNK_SIZE = 10_000
+
+# Statuses every DB has, with fixed ids so queries can filter on them directly.
+PASSED, FAILED, FLAKY = 1, 2, 3
+_KNOWN_STATUSES = {"PASSED": PASSED, "FAILED": FAILED, "FLAKY": FLAKY}
+
+
+def _group_percentiles(
+    groups: np.ndarray, values: np.ndarray, percentiles: List[float]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentiles of `values` per distinct value of `groups`.
+
+    Returns the sorted distinct groups and a (groups, percentiles) array
+    matching `np.percentile` of each group on its own, computed in one pass
+    over all groups by sorting and indexing into each group's segment.
+    """
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    unique_groups, starts, counts = np.unique(
+        groups, return_index=True, return_counts=True
+    )
+    result = np.empty((len(unique_groups), len(percentiles)))
+    for i, percentile in enumerate(percentiles):
+        position = percentile / 100 * (counts - 1)
+        below = np.floor(position).astype(np.int64)
+        weight = position - below
+        lower = values[starts + below]
+        upper = values[starts + np.minimum(below + 1, counts - 1)]
+        # Interpolate from the nearer end, like np.percentile does.
+        result[:, i] = np.where(
+            weight >= 0.5,
+            upper - (upper - lower) * (1 - weight),
+            lower + (upper - lower) * weight,
+        )
+    return unique_groups, result
+
+
+@dataclasses.dataclass
+class PriorityWeights:
+    """How much each kind of result moves a test up in `list_tests_ordered`.
+
+    Every component sums `window - commits.idx` over the matching results,
+    so results of recent commits count more.
+    """
+
+    # Failures within the last `recent_window` commits.
+    recent_failed: float = 1_000_000
+    # Failures of release tests, on top of `failed`.
+    release_failed: float = 1_000
+    failed: float = 1
+    flaky: float = 0.1
+    # Passing runs that took longer than `slow_s`.
+    slow_passed: float = 0.001
+    # Passing runs of tests labeled flaky.
+    green_flaky: float = 0
+    window: int = 100
+    recent_window: int = 10
+    slow_s: float = 600
+
+
+class _Dimension:
+    """Maps the natural key of a dimension table row to its integer id.
+
+    Ids are cached in memory and new rows are inserted on first use, with
+    `extra(*key, **extra_args)` filling in any non-key columns.
+    """
+
+    def __init__(
+        self,
+        db,
+        table: str,
+        columns: Tuple[str, ...],
+        extra_columns: Tuple[str, ...] = (),
+        extra: Optional[Callable[..., Tuple]] = None,
+    ) -> None:
+        self.db = db
+        self.extra = extra
+        insert_columns = columns + extra_columns
+        self.insert_query = (
+            f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+            f"VALUES ({', '.join('?' * len(insert_columns))})"
+        )
+        self.ids: Dict[Tuple, int] = {
+            tuple(key): idx
+            for idx, *key in db.execute(f"SELECT id, {', '.join(columns)} FROM {table}")
+        }
+
+    def get(self, *key, **extra_args) -> int:
+        idx = self.ids.get(key)
+        if idx is None:
+            values = key + self.extra(*key, **extra_args) if self.extra else key
+            idx = self.ids[key] = self.db.execute(self.insert_query, values).lastrowid
+        return idx
 
 
 class ResultsDBWriter:
+    """Writes the star schema read by ResultsDBReader.
+
+    `results` is the fact table: one row per test run carrying integer ids
+    into the `tests`, `jobs`, `commits`, `statuses` and `owners` dimension
+    tables. The `test_result` view joins them back into the original wide
+    layout for ad-hoc queries (see `sql/`).
 
-    test_state = {}
+    Without `wipe`, an existing DB of the current SCHEMA_VERSION is updated
+    in place: `write_commits` moves the commit window and
+    `write_commit_results` only rewrites commits whose data changed.
+    """
 
-    def __init__(self, location=":memory:", wipe=True) -> None:
+    def __init__(
+        self,
+        location=":memory:",
+        wipe=True,
+        test_state: Optional[Dict[str, str]] = None,
+        test_owners: Optional[Dict[str, str]] = None,
+    ) -> None:
         self.table = connect(location)
-        if ResultsDBWriter.test_state == None:
-            ResultsDBReader.test_state = {}
+        # Flaky state per test from `ray_tests/*.json`, see TestStateSource.
+        self.test_state = test_state or {}
+        # Owner per bazel label, see TestMetadataIndex.
+        self.test_owners = test_owners or {}
+        self.rows_written = 0
+        self._bulk_loading = False
         self.table.executescript(
             """
         PRAGMA synchronous=OFF;
         PRAGMA journal_mode=MEMORY;
         """
         )
+        self.table.create_function(
+            "is_flaky_state",
+            1,
+            lambda name: self.get_test_state(name) == "flaky",
+            deterministic=True,
+        )
+        self.table.create_function(
+            "test_owner", 1, self.get_test_owner, deterministic=True
+        )
+        version = self.table.execute("PRAGMA user_version").fetchone()[0]
+        (is_new,) = self.table.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM sqlite_master)"
+        ).fetchone()
+        if not wipe and version != SCHEMA_VERSION and not is_new:
+            print(
+                f"🧹 {location} has schema version {version} instead of "
+                f"{SCHEMA_VERSION}, rebuilding it"
+            )
+        if wipe or version != SCHEMA_VERSION:
+            wipe = True
+            self._create_schema()
+        self._load_dimensions()
         if not wipe:
-            return
+            self._apply_test_state()
+            self.set_test_owners(self.test_owners)
+
+    def _load_dimensions(self):
+        self.jobs = _Dimension(
+            self.table, "jobs", ("external_id", "url", "build_env", "os", "sha")
+        )
+        self.statuses = _Dimension(self.table, "statuses", ("name",))
+        self.owners = _Dimension(self.table, "owners", ("name",))
+        self.tests = _Dimension(
+            self.table,
+            "tests",
+            ("name",),
+            ("is_flaky", "owner_id"),
+            lambda name, owner="unknown": (
+                self.get_test_state(name) == "flaky",
+                self.owners.get(self.get_test_owner(name) or owner),
+            ),
+        )
+
+    def _apply_test_state(self):
+        self.table.executemany(
+            "UPDATE tests SET is_flaky = (?) WHERE id = (?) AND is_flaky != (?)",
+            (
+                (is_flaky, idx, is_flaky)
+                for (name,), idx in self.tests.ids.items()
+                for is_flaky in [self.get_test_state(name) == "flaky"]
+            ),
+        )
+        self._commit()
+
+    def set_test_owners(self, test_owners: Dict[str, str]):
+        """Updates the owner of every test whose label has one in `test_owners`.
+
+        Tests without a known owner keep the one of their first result.
+        """
+        self.test_owners = test_owners
+        self.table.executemany(
+            "UPDATE tests SET owner_id = (?) WHERE id = (?) AND owner_id != (?)",
+            (
+                (owner_id, idx, owner_id)
+                for (name,), idx in self.tests.ids.items()
+                for owner in [self.get_test_owner(name)]
+                if owner is not None
+                for owner_id in [self.owners.get(owner)]
+            ),
+        )
+        self._commit()
+
+    def _create_schema(self):
+        for kind, name in self.table.execute(
+            """
+            SELECT type, name FROM sqlite_master
+            WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'
+            """
+        ).fetchall():
+            self.table.execute(f"DROP {kind} {name}")
+        # Evicted commits leave free pages behind, give them back on the fly.
+        self.table.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.table.execute("VACUUM")
         self.table.executescript(
             """
-        DROP TABLE IF EXISTS test_result;
-        CREATE TABLE test_result (
-            test_name TEXT,
-            status TEXT,
+        CREATE TABLE commits (
+            id INTEGER PRIMARY KEY,
+            sha TEXT UNIQUE,
+            unix_time INT,
+            idx INT,
+            message TEXT,
+            url TEXT,
+            avatar_url TEXT,
+            -- Digest of the results written for the commit.
+            data_version TEXT
+        );
+
+        -- is_flaky is the state from `ray_tests/*.json` and is updated on
+        -- every run, the flaky tag of each run is kept in `results`.
+        CREATE TABLE tests (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE,
+            is_flaky BOOLEAN DEFAULT FALSE,
+            owner_id INT
+        );
+
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY,
+            external_id TEXT,
+            url TEXT,
             build_env TEXT,
             os TEXT,
-            job_url TEXT,
-            job_id TEXT,
             sha TEXT,
-            test_duration_s REAL,
+            UNIQUE (external_id, url, build_env, os, sha)
+        );
+
+        CREATE TABLE statuses (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE
+        );
+
+        CREATE TABLE owners (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE
+        );
+
+        -- commit_id is NULL for results of commits outside of `commits` until
+        -- the next `write_commits` evicts them.
+        CREATE TABLE results (
+            test_id INT,
+            job_id INT,
+            commit_id INT,
+            status_id INT,
+            duration_s REAL,
             is_labeled_flaky BOOLEAN,
-            owner TEXT,
             is_staging_test BOOLEAN
         );
 
-        DROP TABLE IF EXISTS commits;
-        CREATE TABLE commits (
-            sha TEXT,
-            unix_time INT,
-            idx INT,
-            message TEXT,
-            url TEXT,
-            avatar_url TEXT
-        );
+        CREATE VIEW test_result AS
+        SELECT
+            tests.name AS test_name,
+            statuses.name AS status,
+            jobs.build_env,
+            jobs.os,
+            jobs.url AS job_url,
+            jobs.external_id AS job_id,
+            jobs.sha,
+            results.duration_s AS test_duration_s,
+            results.is_labeled_flaky OR tests.is_flaky AS is_labeled_flaky,
+            owners.name AS owner,
+            results.is_staging_test
+        FROM results
+        JOIN tests ON results.test_id = tests.id
+        JOIN jobs ON results.job_id = jobs.id
+        JOIN statuses ON results.status_id = statuses.id
+        JOIN owners ON tests.owner_id = owners.id;
 
-        DROP TABLE IF EXISTS pr_time;
         CREATE TABLE pr_time (
             sha TEXT,
             created_by TEXT,
@@ -76,40 +346,89 @@ class ResultsDBWriter:
             pull_id TEXT,
             duration_min REAL
         );
+        """
+        )
+        self._create_indexes()
+        self.table.executemany(
+            "INSERT INTO statuses VALUES (?,?)",
+            [(idx, name) for name, idx in _KNOWN_STATUSES.items()],
+        )
+        self.table.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.table.commit()
+
+    def _create_indexes(self):
+        for name, columns in _INDEXES.items():
+            self.table.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+    def _commit(self):
+        if not self._bulk_loading:
+            self.table.commit()
 
-        CREATE INDEX test_result_hot_path_job_id
-        ON test_result (job_id);
+    @contextmanager
+    def bulk_load(self, cache_size_mb: int = 256):
+        """Runs all writes of the block in a single transaction.
 
-        CREATE INDEX test_result_hot_path_test_name
-        ON test_result (test_name);
+        If the DB holds no results yet, the indexes are dropped up front and
+        built once at the end instead of being updated on every insert. The
+        block ends with ANALYZE so the reader's queries get fresh statistics.
         """
-        )
+        self.table.execute(f"PRAGMA cache_size = {-cache_size_mb * 1024}")
+        self.table.execute("PRAGMA temp_store = MEMORY")
+        (is_empty,) = self.table.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM results)"
+        ).fetchone()
+        if is_empty:
+            for name in _INDEXES:
+                self.table.execute(f"DROP INDEX IF EXISTS {name}")
 
-    @classmethod
-    def get_test_state(cls, test_name):
-        if test_name in cls.test_state:
-            return cls.test_state[test_name]
+        rows_written = self.rows_written
+        start = time.time()
+        self._bulk_loading = True
         try:
-            data = (
-                boto3.client("s3")
-                .get_object(
-                    Bucket="ray-ci-results",
-                    Key=f"ray_tests/{test_name.replace('/', '_')}.json",
-                )
-                .get("Body")
-                .read()
-                .decode("utf-8")
-            )
-            cls.test_state[test_name] = json.loads(data).get("state", "passing")
-        except ClientError as e:
-            print(f"Failed to get test state for {test_name}: {e}")
-            cls.test_state[test_name] = "passing"
+            yield self
+        except BaseException:
+            self.table.rollback()
+            self._create_indexes()
+            self.table.commit()
+            raise
+        finally:
+            self._bulk_loading = False
+        load_s = time.time() - start
+
+        self._create_indexes()
+        self.table.execute("ANALYZE")
+        self.table.commit()
+        num_rows = self.rows_written - rows_written
+        print(
+            f"📈 Loaded {num_rows} rows in {load_s:.1f}s "
+            f"({num_rows / max(load_s, 1e-6):,.0f} rows/s), "
+            f"indexed and analyzed in {time.time() - start - load_s:.1f}s"
+        )
 
-        return cls.test_state[test_name]
+    def get_test_state(self, test_name):
+        return self.test_state.get(test_state_key(test_name), "passing")
+
+    def get_test_owner(self, test_name) -> Optional[str]:
+        return self.test_owners.get(test_label(test_name))
 
     def write_commits(self, commits: List[GHCommit]):
+        """Makes `commits` the window of the DB.
+
+        Commits are upserted with their new `idx`; commits that slid out of
+        the window are evicted along with their results.
+        """
+        self.table.execute("UPDATE commits SET idx = NULL")
         self.table.executemany(
-            "INSERT INTO commits VALUES (?,?,?,?,?,?)",
+            """
+            INSERT INTO commits (sha, unix_time, idx, message, url, avatar_url)
+            VALUES (?,?,?,?,?,?)
+            ON CONFLICT (sha) DO UPDATE SET
+                unix_time = excluded.unix_time,
+                idx = excluded.idx,
+                message = excluded.message,
+                url = excluded.url,
+                avatar_url = excluded.avatar_url
+            """,
             [
                 (
                     commit.sha,
@@ -122,49 +441,266 @@ class ResultsDBWriter:
                 for i, commit in enumerate(commits)
             ],
         )
-        self.table.commit()
+        self.table.execute("DELETE FROM commits WHERE idx IS NULL")
+        # Results written before their commit was known.
+        self.table.execute(
+            """
+            UPDATE results
+            SET commit_id = (
+                SELECT commits.id FROM jobs, commits
+                WHERE jobs.id = results.job_id AND jobs.sha = commits.sha
+            )
+            WHERE commit_id IS NULL
+            """
+        )
+        for query in [
+            """
+            DELETE FROM results
+            WHERE commit_id IS NULL OR commit_id NOT IN (SELECT id FROM commits)
+            """,
+            "DELETE FROM jobs WHERE id NOT IN (SELECT job_id FROM results)",
+            "DELETE FROM tests WHERE id NOT IN (SELECT test_id FROM results)",
+            "DELETE FROM owners WHERE id NOT IN (SELECT owner_id FROM tests)",
+            "PRAGMA incremental_vacuum",
+        ]:
+            self.table.execute(query)
+        self._commit()
+        self._load_dimensions()
 
-    def write_build_results(self, results: List[BuildResult]):
-        records_to_insert = []
-        for build_result in results:
-            for test in build_result.results:
-                name = f"{build_result.os}:{test.test_name}"
-                records_to_insert.append(
-                    (
-                        name,
-                        test.status,
-                        build_result.build_env,
-                        build_result.os,
-                        build_result.job_url,
-                        build_result.job_id,
-                        build_result.sha,
-                        test.total_duration_s,
-                        test.is_labeled_flaky or ResultsDBWriter.get_test_state(name) == 'flaky',
-                        test.owner,
-                        test.is_labeled_staging,
-                    )
-                )
+    def _start_commit_rewrite(self, sha: str, version: str) -> bool:
+        """Drops the results of `sha` and records `version` for the new ones.
 
-        self.table.executemany(
-            "INSERT INTO test_result VALUES (?,?,?,?,?,?,?,?,?,?, ?)",
-            records_to_insert,
+        Returns False, leaving everything as is, if `version` is already written.
+        """
+        row = self.table.execute(
+            "SELECT data_version FROM commits WHERE sha = (?)", (sha,)
+        ).fetchone()
+        if row is not None and row[0] == version:
+            return False
+        self.table.execute(
+            "DELETE FROM results WHERE job_id IN (SELECT id FROM jobs WHERE sha = (?))",
+            (sha,),
         )
-        self.table.commit()
+        # The new results add back the jobs that are still there.
+        self.table.execute("DELETE FROM jobs WHERE sha = (?)", (sha,))
+        self.jobs.ids = {
+            key: idx for key, idx in self.jobs.ids.items() if key[-1] != sha
+        }
+        self.table.execute(
+            "UPDATE commits SET data_version = (?) WHERE sha = (?)", (version, sha)
+        )
+        return True
+
+    def write_commit_results(
+        self, sha: str, results: TestResultTable, version: str
+    ) -> bool:
+        """Replaces the results of commit `sha` unless `version` is already written.
+
+        Returns whether anything was written.
+        """
+        if not self._start_commit_rewrite(sha, version):
+            return False
+        self.write_build_results(results)
+        return True
+
+    def merge_commit_shard(self, sha: str, shard_path: str, version: str) -> bool:
+        """Like `write_commit_results`, but copies the results of commit `sha`
+        from a shard DB built by another ResultsDBWriter (see `shard.py`).
+
+        Dimension rows are matched by their natural keys with `INSERT ...
+        SELECT` over the attached shard. A shard can only be detached outside
+        of a transaction, so this commits even during `bulk_load`.
+        """
+        if not self._start_commit_rewrite(sha, version):
+            return False
+        self.table.execute("ATTACH DATABASE (?) AS shard", (shard_path,))
+        try:
+            for query in [
+                "INSERT OR IGNORE INTO owners (name) SELECT name FROM shard.owners",
+                """
+                INSERT OR IGNORE INTO owners (name)
+                SELECT test_owner(name) FROM shard.tests
+                WHERE test_owner(name) IS NOT NULL
+                """,
+                """
+                INSERT OR IGNORE INTO tests (name, is_flaky, owner_id)
+                SELECT shard_tests.name, is_flaky_state(shard_tests.name), owners.id
+                FROM shard.tests AS shard_tests
+                JOIN shard.owners AS shard_owners
+                    ON shard_tests.owner_id = shard_owners.id
+                JOIN owners
+                    ON owners.name
+                    = COALESCE(test_owner(shard_tests.name), shard_owners.name)
+                """,
+                """
+                INSERT OR IGNORE INTO jobs (external_id, url, build_env, os, sha)
+                SELECT external_id, url, build_env, os, sha FROM shard.jobs
+                """,
+                "INSERT OR IGNORE INTO statuses (name) SELECT name FROM shard.statuses",
+            ]:
+                self.table.execute(query)
+            cursor = self.table.execute(
+                """
+                INSERT INTO results
+                SELECT tests.id, jobs.id, commits.id, statuses.id,
+                    r.duration_s, r.is_labeled_flaky, r.is_staging_test
+                FROM shard.results AS r
+                JOIN shard.tests AS shard_tests ON r.test_id = shard_tests.id
+                JOIN tests ON tests.name = shard_tests.name
+                JOIN shard.jobs AS shard_jobs ON r.job_id = shard_jobs.id
+                JOIN jobs
+                    ON jobs.external_id = shard_jobs.external_id
+                    AND jobs.url = shard_jobs.url
+                    AND jobs.build_env = shard_jobs.build_env
+                    AND jobs.os = shard_jobs.os
+                    AND jobs.sha = shard_jobs.sha
+                JOIN shard.statuses AS shard_statuses ON r.status_id = shard_statuses.id
+                JOIN statuses ON statuses.name = shard_statuses.name
+                LEFT JOIN commits ON commits.sha = shard_jobs.sha
+                """
+            )
+            self.rows_written += cursor.rowcount
+            self.table.commit()
+        except BaseException:
+            self.table.rollback()
+            raise
+        finally:
+            self.table.execute("DETACH DATABASE shard")
+        # Rows were added behind the back of the dimension caches.
+        self._load_dimensions()
+        return True
+
+    def _commit_ids(self) -> Dict[str, int]:
+        return dict(self.table.execute("SELECT sha, id FROM commits"))
+
+    def _write_rows(self, rows: Iterable[Tuple]):
+        """Inserts rows laid out like the `test_result` view."""
+        commit_ids = self._commit_ids()
+        self._insert_results(
+            (
+                (
+                    self.tests.get(test_name, owner=owner),
+                    self.jobs.get(job_id, job_url, build_env, os, sha),
+                    commit_ids.get(sha),
+                    self.statuses.get(status),
+                    duration_s,
+                    is_labeled_flaky,
+                    is_labeled_staging,
+                )
+                for (
+                    test_name,
+                    status,
+                    build_env,
+                    os,
+                    job_url,
+                    job_id,
+                    sha,
+                    duration_s,
+                    is_labeled_flaky,
+                    owner,
+                    is_labeled_staging,
+                ) in rows
+            )
+        )
+        self._commit()
+
+    def _insert_results(self, records: Iterable[Tuple]):
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, _INSERT_CHUNK_SIZE))
+            if not chunk:
+                return
+            self.table.executemany(
+                "INSERT INTO results VALUES (?,?,?,?,?,?,?)", chunk
+            )
+            self.rows_written += len(chunk)
+
+    def write_build_results(
+        self,
+        results: Union[
+            TestResultTable, Iterable[Union[TestResultTable, BuildResult]]
+        ],
+    ):
+        """Writes a table of results, or an iterator of tables or builds.
+
+        Iterators are consumed lazily and rows are inserted in chunks, so
+        only one table or build has to be in memory at a time.
+        """
+        if isinstance(results, TestResultTable):
+            results = [results]
+        for table in results:
+            if not isinstance(table, TestResultTable):
+                table = TestResultTable.from_build_results([table])
+            self._insert_results(self._table_records(table))
+        self._commit()
+
+    def _table_records(self, results: TestResultTable) -> Iterator[Tuple]:
+        # Resolve dimension ids once per build and per interned string rather
+        # than once per row.
+        strings = results.strings.strings
+        commit_ids = self._commit_ids()
+        build_job_ids, build_commit_ids, build_oses = [], [], []
+        for i in range(results.num_builds):
+            sha, job_url, os, build_env, job_id = (
+                strings[getattr(results, column)[i]] for column in BUILD_COLUMNS
+            )
+            build_job_ids.append(self.jobs.get(job_id, job_url, build_env, os, sha))
+            build_commit_ids.append(commit_ids.get(sha))
+            build_oses.append(os)
+
+        status_ids = {}
+        test_ids: Dict[Tuple[str, int], int] = {}
+        for build, name, status, duration_s, flags, owner in zip(
+            results.test_build,
+            results.test_name,
+            results.test_status,
+            results.test_duration_s,
+            results.test_flags,
+            results.test_owner,
+        ):
+            key = (build_oses[build], name)
+            test_id = test_ids.get(key)
+            if test_id is None:
+                test_id = test_ids[key] = self.tests.get(
+                    f"{build_oses[build]}:{strings[name]}", owner=strings[owner]
+                )
+            if status not in status_ids:
+                status_ids[status] = self.statuses.get(strings[status])
+            yield (
+                test_id,
+                build_job_ids[build],
+                build_commit_ids[build],
+                status_ids[status],
+                duration_s,
+                bool(flags & FLAG_FLAKY),
+                bool(flags & FLAG_STAGING),
+            )
+
+    def _jobs_with_results(self, column: str, os: Optional[str] = None) -> Set[str]:
+        """Values of `jobs.<column>` over all jobs that have results, in one query."""
+        return {
+            value
+            for (value,) in self.table.execute(
+                f"""
+                SELECT DISTINCT {column} FROM jobs
+                WHERE EXISTS (SELECT 1 FROM results WHERE results.job_id == jobs.id)
+                AND ((?) IS NULL OR os == (?))
+                """,
+                (os, os),
+            )
+        }
 
     def write_buildkite_data(self, buildkite_data: List[BuildkiteStatus]):
+        jobs_with_results = self._jobs_with_results("external_id")
         records_to_insert = []
         for job in buildkite_data:
-            num_result = self.table.execute(
-                f"SELECT COUNT(*) FROM test_result WHERE job_id == (?)",
-                (job.job_id,),
-            ).fetchone()[0]
             status = "PASSED" if job.passed else "FAILED"
             if job.state == "FINISHED":
                 records_to_insert.append(
                     (
                         f"bk://{job.label}",
                         # Mark the entire build passed when individual tests result uploaded
-                        status if num_result == 0 else "PASSED",
+                        "PASSED" if job.job_id in jobs_with_results else status,
                         job.label,
                         "linux",
                         job.url,
@@ -176,27 +712,20 @@ class ResultsDBWriter:
                         False,  # is_labeled_staging
                     )
                 )
-        self.table.executemany(
-            "INSERT INTO test_result VALUES (?,?,?,?,?,?,?,?,?,?, ?)",
-            records_to_insert,
-        )
-        self.table.commit()
+        self._write_rows(records_to_insert)
 
     def write_gha_data(self, gha_data: List[GHAJobStat]):
+        shas_with_windows_results = self._jobs_with_results("sha", os="windows")
         records_to_insert = []
         for gha_run in gha_data:
-            num_result = len(
-                self.table.execute(
-                    f"SELECT * FROM test_result WHERE sha == (?) AND os == (?)",
-                    (gha_run.commit, "windows"),
-                ).fetchall()
-            )
             if gha_run.state is not None:
                 records_to_insert.append(
                     (
                         f"{gha_run.os}://github-action/{gha_run.env}",
                         # Mark the entire build passed when individual tests result uploaded
-                        gha_run.state if num_result == 0 else "PASSED",
+                        "PASSED"
+                        if gha_run.commit in shas_with_windows_results
+                        else gha_run.state,
                         gha_run.env,
                         gha_run.os,
                         gha_run.url,
@@ -208,122 +737,95 @@ class ResultsDBWriter:
                         False,  # is_labeled_staging
                     )
                 )
-        self.table.executemany(
-            "INSERT INTO test_result VALUES (?,?,?,?,?,?,?,?,?,?,?)",
-            records_to_insert,
-        )
-        self.table.commit()
-
-    def backfill_test_owners(self):
-        results = self.table.execute(
-            """
-        WITH need_backfill as (
-            SELECT test_name
-            FROM test_result
-            GROUP BY test_name
-            HAVING COUNT(DISTINCT owner) > 1
-        )
-        SELECT need_backfill.test_name, owner
-        FROM need_backfill, test_result
-        WHERE need_backfill.test_name = test_result.test_name
-        AND test_result.owner NOT LIKE 'unknown'
-        GROUP BY need_backfill.test_name
-        """
-        ).fetchall()
-        self.table.executemany(
-            """
-            UPDATE test_result
-            SET owner = (?)
-            WHERE test_name = (?)
-            """,
-            [(owner, test_name) for test_name, owner in results],
-        )
-        self.table.commit()
+        self._write_rows(records_to_insert)
 
 
 class ResultsDBReader:
-    def __init__(self, path) -> None:
+    def __init__(self, path, matrix=None) -> None:
         self.table = connect(path)
+        # StatusMatrix of the same DB; queries it covers are answered from it.
+        self.matrix = matrix
+        self.test_ids: Dict[str, int] = dict(
+            self.table.execute("SELECT name, id FROM tests")
+        )
 
-    def list_tests_ordered(self):
-        query = f"""
-            SELECT test_name, SUM(100 - commits.idx) as weight
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-            AND status == (?)
-            GROUP BY test_name
-        """
-        failed_tests = self.table.execute(query, ("FAILED",)).fetchall()
-        flaky_tests = self.table.execute(query, ("FLAKY",)).fetchall()
-        passed_tests = self.table.execute(
-            f"""
-            SELECT test_name, SUM(100 - commits.idx) as weight
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-            AND status == (?)
-            AND test_result.test_duration_s > 600
-            GROUP BY test_name
-        """,
-            ("PASSED",),
-        ).fetchall()
-        top_failed_tests = self.table.execute(
-            """
-            SELECT test_name, SUM(10 - commits.idx) as weight
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-            AND status == 'FAILED'
-            AND commits.idx < 10
-            GROUP BY test_name
+    def list_tests_ordered(
+        self, weights: Optional[PriorityWeights] = None
+    ) -> List[Tuple[str, float]]:
+        """Tests worth looking at with their priority, highest first.
+
+        All score components come out of a single scan over the results;
+        a component is NULL for tests without any matching result.
         """
-        ).fetchall()
-        green_flaky_tests = self.table.execute(
+        weights = weights or PriorityWeights()
+        cursor = self.table.execute(
             """
-            SELECT test_name, SUM(100 - commits.idx) as weight
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-              AND status == 'PASSED'
-              AND is_labeled_flaky = 1
-            GROUP BY test_name
-        """
-        ).fetchall()
-
-        prioritization = defaultdict(int)
-        for test_name, score in top_failed_tests:
-            prioritization[test_name] += score * 1_000_000  # Prioritize recent failure.
-
-        for test_name, score in failed_tests:
-            if "release://" in test_name:
-                prioritization[test_name] += (
-                    score * 1_000
-                )  # Prioritize release tests failure
-
-        for test_name, score in failed_tests:
-            prioritization[test_name] += score
-
-        # for test_name, score in green_flaky_tests:
-        #     prioritization[test_name] += 0.5 * score
-
-        for test_name, score in flaky_tests:
-            prioritization[test_name] += 0.1 * score
-
-        for test_name, score in passed_tests:
-            prioritization[test_name] += 0.001 * score
-
-        results = sorted(list(prioritization.items()), key=lambda kv: -kv[1])
-        return results
+            SELECT tests.name,
+                SUM(CASE WHEN status_id == :failed AND commits.idx < :recent_window
+                    THEN :recent_window - commits.idx END),
+                SUM(CASE WHEN status_id == :failed AND instr(tests.name, 'release://') > 0
+                    THEN :window - commits.idx END),
+                SUM(CASE WHEN status_id == :failed
+                    THEN :window - commits.idx END),
+                SUM(CASE WHEN status_id == :flaky
+                    THEN :window - commits.idx END),
+                SUM(CASE WHEN status_id == :passed AND results.duration_s > :slow_s
+                    THEN :window - commits.idx END),
+                SUM(CASE WHEN status_id == :passed
+                    AND (results.is_labeled_flaky OR tests.is_flaky)
+                    THEN :window - commits.idx END)
+            FROM results, commits, tests
+            WHERE results.commit_id == commits.id
+            AND results.test_id == tests.id
+            GROUP BY tests.name
+            """,
+            {
+                "passed": PASSED,
+                "failed": FAILED,
+                "flaky": FLAKY,
+                "window": weights.window,
+                "recent_window": weights.recent_window,
+                "slow_s": weights.slow_s,
+            },
+        )
+        component_weights = [
+            weights.recent_failed,
+            weights.release_failed,
+            weights.failed,
+            weights.flaky,
+            weights.slow_passed,
+            weights.green_flaky,
+        ]
+        prioritization = []
+        for test_name, *components in cursor:
+            priority = 0
+            first_component = None
+            for i, (score, weight) in enumerate(zip(components, component_weights)):
+                if score is not None and weight:
+                    priority += score * weight
+                    if first_component is None:
+                        first_component = i
+            if first_component is not None:
+                prioritization.append((-priority, first_component, test_name))
+        # Ties are kept in the order the components used to be merged in.
+        prioritization.sort()
+        return [(test_name, -priority) for priority, _, test_name in prioritization]
 
     def get_travis_link(self, test_name: str):
         cursor = self.table.execute(
             """
             -- Travis Link
-            SELECT commits.sha, commits.unix_time, commits.message, build_env, job_url, os, status
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-            AND status in ('FAILED', 'FLAKY')
-            AND test_name == (?)
+            SELECT commits.sha, commits.unix_time, commits.message,
+                jobs.build_env, jobs.url, jobs.os, statuses.name
+            FROM results, commits, jobs, statuses
+            WHERE results.commit_id == commits.id
+            AND results.job_id == jobs.id
+            AND results.status_id == statuses.id
+            AND results.status_id in (?, ?)
+            AND results.test_id == (?)
             ORDER BY commits.idx
             """,
-            (test_name,),
+            (FAILED, FLAKY, self.test_ids.get(test_name)),
         )
         return [
             SiteTravisLink(
@@ -343,13 +845,13 @@ class ResultsDBReader:
         cursor = self.table.execute(
             """
             -- Build Time Stats
-            SELECT test_duration_s
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
+            SELECT duration_s
+            FROM results, commits
+            WHERE results.commit_id == commits.id
             AND commits.idx <= 50
-            AND test_name == (?)
+            AND results.test_id == (?)
             """,
-            (test_name,),
+            (self.test_ids.get(test_name),),
         )
         arr = np.array(list(cursor)).flatten()
         if len(arr) == 0:
@@ -359,43 +861,57 @@ class ResultsDBReader:
 
     def get_marked_flaky_status(self, test_name: str) -> bool:
         cursor = self.table.execute(
-            "SELECT SUM(is_labeled_flaky) FROM test_result WHERE test_name == (?)",
-            (test_name,),
+            """
+            SELECT SUM(results.is_labeled_flaky OR tests.is_flaky)
+            FROM results, tests
+            WHERE results.test_id == tests.id AND results.test_id == (?)
+            """,
+            (self.test_ids.get(test_name),),
         )
         return bool(list(cursor)[0][0])
 
     def get_test_owner(self, test_name: str) -> str:
         cursor = self.table.execute(
-            "SELECT owner FROM test_result WHERE test_name == (?) GROUP BY owner",
-            (test_name,),
+            """
+            SELECT owners.name FROM tests, owners
+            WHERE tests.owner_id == owners.id AND tests.id == (?)
+            """,
+            (self.test_ids.get(test_name),),
         )
-        owners = cursor.fetchall()
-        return owners[0][0]
+        return cursor.fetchone()[0]
 
     def get_all_owners(self) -> List[str]:
         return list(
             chain.from_iterable(
-                self.table.execute("SELECT owner FROM test_result GROUP BY owner")
+                self.table.execute(
+                    """
+                    SELECT name FROM owners
+                    WHERE id IN (SELECT DISTINCT owner_id FROM tests)
+                    ORDER BY name
+                    """
+                )
             )
         )
 
     def get_commit_tooltips(self, test_name: str):
+        if self.matrix is not None:
+            return self.matrix.commit_tooltips(test_name)
         cursor = self.table.execute(
             """
             -- Commit Tooltip
-            WITH filtered(sha, num_failed, num_flaky, num_passed) AS (
-                SELECT sha, SUM(status == 'FAILED'), SUM(status == 'FLAKY'), SUM(status == 'PASSED')
-                FROM test_result
-                WHERE test_name == (?)
-                GROUP BY sha
+            WITH filtered(commit_id, num_failed, num_flaky, num_passed) AS (
+                SELECT commit_id, SUM(status_id == (?)), SUM(status_id == (?)), SUM(status_id == (?))
+                FROM results
+                WHERE test_id == (?)
+                GROUP BY commit_id
             )
             SELECT commits.sha, commits.message, commits.url, commits.avatar_url,
                 filtered.num_failed, filtered.num_flaky, filtered.num_passed
             FROM commits LEFT JOIN filtered
-            ON commits.sha == filtered.sha
+            ON commits.id == filtered.commit_id
             ORDER BY commits.idx
             """,
-            (test_name,),
+            (FAILED, FLAKY, PASSED, self.test_ids.get(test_name)),
         )
         return [
             SiteCommitTooltip(
@@ -409,17 +925,157 @@ class ResultsDBReader:
             for _, msg, url, avatar, num_failed, num_flaky, num_passed in cursor.fetchall()
         ]
 
-    def get_stats(self):
+    def _names(self, test_names: Iterable[str]) -> Dict[int, str]:
+        return {
+            self.test_ids[name]: name for name in test_names if name in self.test_ids
+        }
+
+    def get_all_travis_links(
+        self, test_names: Sequence[str]
+    ) -> Dict[str, List[SiteTravisLink]]:
+        """`get_travis_link` of every test in `test_names`, in one query."""
+        names = self._names(test_names)
+        links: Dict[str, List[SiteTravisLink]] = {name: [] for name in test_names}
+        cursor = self.table.execute(
+            """
+            SELECT results.test_id, commits.sha, commits.unix_time, commits.message,
+                jobs.build_env, jobs.url, jobs.os, statuses.name
+            FROM results, commits, jobs, statuses
+            WHERE results.commit_id == commits.id
+            AND results.job_id == jobs.id
+            AND results.status_id == statuses.id
+            AND results.status_id in (?, ?)
+            ORDER BY results.test_id, commits.idx
+            """,
+            (FAILED, FLAKY),
+        )
+        for test_id, sha, unix_time, msg, env, url, os, status in cursor:
+            if test_id in names:
+                links[names[test_id]].append(
+                    SiteTravisLink(
+                        sha_short=sha[:6],
+                        sha=sha,
+                        commit_time=unix_time,
+                        commit_message=msg,
+                        build_env=env,
+                        job_url=url,
+                        os=os,
+                        status=status,
+                    )
+                )
+        return links
+
+    def get_all_recent_build_time_stats(
+        self, test_names: Sequence[str]
+    ) -> Dict[str, List[float]]:
+        """`get_recent_build_time_stats` of every test in `test_names`, in one query."""
+        rows = np.fromiter(
+            self.table.execute(
+                """
+                SELECT test_id, duration_s
+                FROM results, commits
+                WHERE results.commit_id == commits.id
+                AND commits.idx <= 50
+                """
+            ),
+            dtype=[("test_id", np.int64), ("duration_s", np.float64)],
+        )
+        test_ids, stats = _group_percentiles(
+            rows["test_id"], rows["duration_s"], [0, 50, 90]
+        )
+        stats_by_id = dict(zip(test_ids.tolist(), stats.tolist()))
+        return {
+            name: stats_by_id.get(self.test_ids.get(name), [0, 0, 0])
+            for name in test_names
+        }
+
+    def get_all_marked_flaky_statuses(
+        self, test_names: Sequence[str]
+    ) -> Dict[str, bool]:
+        """`get_marked_flaky_status` of every test in `test_names`, in one query."""
+        flaky = {
+            test_id: bool(is_flaky)
+            for test_id, is_flaky in self.table.execute(
+                """
+                SELECT results.test_id, MAX(results.is_labeled_flaky OR tests.is_flaky)
+                FROM results, tests
+                WHERE results.test_id == tests.id
+                GROUP BY results.test_id
+                """
+            )
+        }
+        return {
+            name: flaky.get(self.test_ids.get(name), False) for name in test_names
+        }
+
+    def get_all_test_owners(self, test_names: Sequence[str]) -> Dict[str, str]:
+        """`get_test_owner` of every test in `test_names`, in one query."""
+        owners = dict(
+            self.table.execute(
+                """
+                SELECT tests.name, owners.name FROM tests, owners
+                WHERE tests.owner_id == owners.id
+                """
+            )
+        )
+        return {name: owners.get(name, "unknown") for name in test_names}
+
+    def get_all_commit_tooltips(
+        self, test_names: Sequence[str]
+    ) -> Dict[str, List[SiteCommitTooltip]]:
+        """`get_commit_tooltips` of every test in `test_names`, in one query."""
+        if self.matrix is not None:
+            return {name: self.matrix.commit_tooltips(name) for name in test_names}
+        names = self._names(test_names)
+        commits = self.table.execute(
+            "SELECT id, message, url, avatar_url FROM commits ORDER BY idx"
+        ).fetchall()
+        counts: Dict[Optional[int], Dict[int, List[int]]] = defaultdict(dict)
+        cursor = self.table.execute(
+            """
+            SELECT test_id, commit_id,
+                SUM(status_id == (?)), SUM(status_id == (?)), SUM(status_id == (?))
+            FROM results
+            GROUP BY test_id, commit_id
+            """,
+            (FAILED, FLAKY, PASSED),
+        )
+        for test_id, commit_id, *num_failed_flaky_passed in cursor:
+            if test_id in names:
+                counts[test_id][commit_id] = num_failed_flaky_passed
+        no_results = (None, None, None)
+        return {
+            name: [
+                SiteCommitTooltip(
+                    num_failed=num_failed,
+                    num_flaky=num_flaky,
+                    num_passed=num_passed,
+                    message=msg,
+                    author_avatar=avatar,
+                    commit_url=url,
+                )
+                for commit_id, msg, url, avatar in commits
+                for num_failed, num_flaky, num_passed in [
+                    test_counts.get(commit_id, no_results)
+                ]
+            ]
+            for name in test_names
+            for test_counts in [counts.get(self.test_ids.get(name), {})]
+        }
+
+    def _master_green_rates(self) -> Tuple[Optional[float], Optional[float]]:
+        if self.matrix is not None:
+            return self.matrix.master_green_rates()
+
         master_green_query = """
             -- Master Green Rate (past 100 commits)
             SELECT SUM(green)*1.0/COUNT(green)
             FROM (
-                SELECT SUM(status == 'FAILED') == 0 as green
-                FROM test_result, commits
-                WHERE test_result.sha == commits.sha
-                  AND test_result.is_staging_test == FALSE
-                GROUP BY test_result.sha
-                ORDER BY commits.idx
+                SELECT SUM(status_id == (?)) == 0 as green
+                FROM results
+                WHERE commit_id IS NOT NULL
+                  AND is_staging_test == FALSE
+                GROUP BY commit_id
             )
         """
 
@@ -427,59 +1083,86 @@ class ResultsDBReader:
             -- Master Green Rate (past 100 commits) (without flaky tests)
             SELECT SUM(green)*1.0/COUNT(green)
             FROM (
-                SELECT SUM(status == 'FAILED') == 0 as green
-                FROM test_result, commits
-                WHERE test_result.sha == commits.sha
-                  AND test_result.is_labeled_flaky == 0
-                  AND test_result.os NOT LIKE 'windows'
-                  AND test_result.is_staging_test == FALSE
-                GROUP BY commits.sha
-                ORDER BY commits.idx
+                SELECT SUM(status_id == (?)) == 0 as green
+                FROM results, jobs, tests
+                WHERE results.job_id == jobs.id
+                  AND results.test_id == tests.id
+                  AND results.commit_id IS NOT NULL
+                  AND results.is_labeled_flaky == 0
+                  AND tests.is_flaky == 0
+                  AND jobs.os NOT LIKE 'windows'
+                  AND results.is_staging_test == FALSE
+                GROUP BY results.commit_id
             )
         """
 
+        return (
+            self.table.execute(master_green_query, (FAILED,)).fetchone()[0],
+            self.table.execute(
+                master_green_without_flaky_query, (FAILED,)
+            ).fetchone()[0],
+        )
+
+    def get_stats(self):
+        master_green, master_green_without_flaky = self._master_green_rates()
         return [
             SiteStatItem(
                 key="Master Green (past 100 commits)",
-                value=self.table.execute(master_green_query).fetchone()[0] * 100,
+                value=master_green * 100,
                 # weekly green goal
                 desired_value=20,
                 unit="%",
             ),
             SiteStatItem(
                 key="Master Green (without window + flaky tests)",
-                value=self.table.execute(master_green_without_flaky_query).fetchone()[0]
-                * 100,
+                value=master_green_without_flaky * 100,
                 # weekly green goal
                 desired_value=20,
                 unit="%",
             ),
         ]
 
-    def get_table_stat(self):
+    def _per_team_pass_rates(
+        self, max_idx: int
+    ) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]]]:
+        if self.matrix is not None:
+            return self.matrix.per_team_pass_rates(max_idx)
+
         query_template = """
         SELECT owner, SUM(green)*1.0/COUNT(green) as pass_rate
         FROM (
-            SELECT test_result.owner, SUM(status == 'FAILED') == 0 as green
-            FROM test_result, commits
-            WHERE test_result.sha == commits.sha
-            AND commits.idx <= 100
+            SELECT owners.name AS owner, SUM(status_id == (?)) == 0 as green
+            FROM results, commits, jobs, owners, tests
+            WHERE results.commit_id == commits.id
+            AND results.job_id == jobs.id
+            AND results.test_id == tests.id
+            AND tests.owner_id == owners.id
+            AND commits.idx <= (?)
             {condition}
-            GROUP BY test_result.owner, test_result.sha
-            ORDER BY commits.idx
+            GROUP BY tests.owner_id, results.commit_id
         )
         GROUP BY owner
         ORDER BY owner
         """
 
-        per_team_pass_rate_all = self.table.execute(
-            query_template.format(condition="")
-        ).fetchall()
-        per_team_pass_rate_no_windows_no_flaky = self.table.execute(
-            query_template.format(
-                condition="AND test_result.os NOT LIKE 'windows' AND test_result.is_labeled_flaky == 0"
-            )
-        ).fetchall()
+        return (
+            self.table.execute(
+                query_template.format(condition=""), (FAILED, max_idx)
+            ).fetchall(),
+            self.table.execute(
+                query_template.format(
+                    condition="AND jobs.os NOT LIKE 'windows'"
+                    " AND results.is_labeled_flaky == 0 AND tests.is_flaky == 0"
+                ),
+                (FAILED, max_idx),
+            ).fetchall(),
+        )
+
+    def get_table_stat(self):
+        (
+            per_team_pass_rate_all,
+            per_team_pass_rate_no_windows_no_flaky,
+        ) = self._per_team_pass_rates(max_idx=100)
 
         owners = dict(per_team_pass_rate_all).keys()
 
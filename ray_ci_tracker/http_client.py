@@ -0,0 +1,62 @@
+from typing import Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    _HAS_HTTP2 = True
+except ImportError:
+    _HAS_HTTP2 = False
+
+
+class HTTPClientPool:
+    """Process-wide pool of keep-alive `httpx.AsyncClient`s, one per host.
+
+    Data sources ask the pool for the client of the host they talk to, so all
+    per-commit requests share connections instead of paying for a new TLS
+    handshake every call. Close the pool once when the command is done.
+    """
+
+    def __init__(
+        self,
+        *,
+        http2: bool = False,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry_s: float = 30.0,
+        timeout_s: float = 60.0,
+    ) -> None:
+        if http2 and not _HAS_HTTP2:
+            print("⚠️ HTTP/2 requested but the `h2` package is missing, using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry_s,
+        )
+        self.timeout = httpx.Timeout(timeout_s)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        parsed = httpx.URL(url)
+        origin = f"{parsed.scheme}://{parsed.netloc.decode('ascii')}"
+        if origin not in self._clients:
+            self._clients[origin] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._clients[origin]
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+    async def __aenter__(self) -> "HTTPClientPool":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import ujson as json
+from dataclasses_json import DataClassJsonMixin
+
+from ray_ci_tracker.interfaces import GHCommit
+from ray_ci_tracker.s3_client import S3Object
+
+COMPLETE = "complete"
+PARTIAL = "partial"
+MISSING = "missing"
+
+
+@dataclass
+class CommitSyncState(DataClassJsonMixin):
+    sha: str
+    state: str
+    last_checked_s: float
+    num_objects: int
+    listing_digest: str
+
+
+def _listing_digest(objects: List[S3Object]) -> str:
+    digest = hashlib.sha1()
+    for obj in sorted(objects, key=lambda o: o.key):
+        digest.update(f"{obj.key}\0{obj.size}\0{obj.etag}\n".encode())
+    return digest.hexdigest()
+
+
+class SyncManifest:
+    """Per-commit download state persisted in the cache dir.
+
+    A commit is final once it is older than `final_after_s` and its S3 listing
+    did not change between two checks; commits that never got any data are
+    given up on after the same delay. Final commits are not synced again.
+    """
+
+    FILE_NAME = "sync_manifest.json"
+
+    def __init__(self, path: Path, final_after_s: float) -> None:
+        self.path = path
+        self.final_after_s = final_after_s
+        self.commits: Dict[str, CommitSyncState] = {}
+        if path.exists():
+            with open(path) as f:
+                self.commits = {
+                    sha: CommitSyncState.from_dict(state)
+                    for sha, state in json.load(f).items()
+                }
+
+    @classmethod
+    def load(cls, cache_path: Path, final_after_s: float) -> "SyncManifest":
+        return cls(cache_path / cls.FILE_NAME, final_after_s)
+
+    def _is_old(self, commit: GHCommit, now: float) -> bool:
+        return now - commit.unix_time_s >= self.final_after_s
+
+    def needs_sync(self, commit: GHCommit, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        state = self.commits.get(commit.sha)
+        if state is None:
+            return True
+        if state.state == COMPLETE:
+            return False
+        if state.state == MISSING:
+            return not self._is_old(commit, now)
+        return True
+
+    def listing_digest(self, sha: str) -> Optional[str]:
+        state = self.commits.get(sha)
+        return state.listing_digest if state else None
+
+    def record(
+        self, commit: GHCommit, objects: List[S3Object], now: Optional[float] = None
+    ) -> CommitSyncState:
+        now = time.time() if now is None else now
+        digest = _listing_digest(objects)
+        previous = self.commits.get(commit.sha)
+
+        if not objects:
+            state = MISSING
+        elif (
+            self._is_old(commit, now)
+            and previous is not None
+            and previous.listing_digest == digest
+        ):
+            state = COMPLETE
+        else:
+            state = PARTIAL
+
+        self.commits[commit.sha] = CommitSyncState(
+            sha=commit.sha,
+            state=state,
+            last_checked_s=now,
+            num_objects=len(objects),
+            listing_digest=digest,
+        )
+        return self.commits[commit.sha]
+
+    def prune(self, commits: List[GHCommit]):
+        window = {commit.sha for commit in commits}
+        self.commits = {
+            sha: state for sha, state in self.commits.items() if sha in window
+        }
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({sha: s.to_dict() for sha, s in self.commits.items()}, f)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> Dict[str, int]:
+        counts = {COMPLETE: 0, PARTIAL: 0, MISSING: 0}
+        for state in self.commits.values():
+            counts[state.state] += 1
+        return counts
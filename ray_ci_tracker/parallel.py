@@ -0,0 +1,497 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import ujson as json
+
+from ray_ci_tracker.cache_format import (
+    CacheFormatError,
+    decode_table,
+    encode_table,
+    read_key,
+)
+from ray_ci_tracker.columnar import TestResultTable
+from ray_ci_tracker.common import (
+    _assemble_build,
+    _bazel_logs,
+    _parse_bazel_log,
+    _read_build_metadata,
+)
+from ray_ci_tracker.database import ResultsDBWriter
+from ray_ci_tracker.interfaces import BuildResult
+from ray_ci_tracker.test_metadata import TargetConfig, TestMetadataIndex
+
+
+@dataclass
+class _PendingBuild:
+    build: BuildResult
+    logs: List[Path]
+    cache_file: Optional[Path]
+    fingerprint: str
+
+
+def _job_fingerprint(build_dir: Path) -> str:
+    digest = hashlib.sha1()
+    for path in [build_dir / "metadata.json", *_bazel_logs(build_dir)]:
+        if path.exists():
+            stat = path.stat()
+            digest.update(f"{path.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _load_cached_job(cache_file: Path, fingerprint: str) -> Optional[TestResultTable]:
+    if not cache_file.exists():
+        return None
+    with open(cache_file, "rb") as f:
+        data = f.read()
+    try:
+        if read_key(data) != fingerprint:
+            return None
+        return decode_table(data)
+    except CacheFormatError:
+        return None
+
+
+def _configs_file(cache_file: Path) -> Path:
+    return cache_file.with_suffix(".configs.json")
+
+
+def _load_cached_configs(
+    cache_file: Path, fingerprint: str
+) -> Optional[List[TargetConfig]]:
+    path = _configs_file(cache_file)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            loaded = json.load(f)
+    except ValueError:
+        return None
+    if loaded.get("key") != fingerprint:
+        return None
+    return [TargetConfig(*config) for config in loaded["configs"]]
+
+
+def _store_cached_job(
+    cache_file: Path,
+    fingerprint: str,
+    table: TestResultTable,
+    configs: Iterable[TargetConfig],
+):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # The configs go first: a table is only used along with its configs.
+    configs_file = _configs_file(cache_file)
+    tmp_path = configs_file.with_name(configs_file.name + ".tmp")
+    unique = {config.digest: config for config in configs}.values()
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "key": fingerprint,
+                "configs": [
+                    [config.label, config.target_kind, config.tags, config.digest]
+                    for config in unique
+                ],
+            },
+            f,
+        )
+    os.replace(tmp_path, configs_file)
+
+    tmp_path = cache_file.with_name(cache_file.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(encode_table(table, key=fingerprint))
+    os.replace(tmp_path, cache_file)
+
+
+# Known `targetConfigured` events of the index, set once per worker.
+_worker_configs: Dict[str, TargetConfig] = {}
+
+
+def _init_worker(known_configs: Dict[str, TargetConfig]):
+    global _worker_configs
+    _worker_configs = known_configs
+
+
+def _parse_log_task(log: Path) -> Tuple[TestResultTable, List[TargetConfig]]:
+    return _parse_bazel_log(log, _worker_configs)
+
+
+class StageStats:
+    """Items and rows that went through a pipeline stage, and how long it was busy.
+
+    Overlapping items of the same stage count towards busy time once.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.busy_s = 0.0
+        self._active = 0
+        self._busy_since = 0.0
+
+    def start(self):
+        if self._active == 0:
+            self._busy_since = time.time()
+        self._active += 1
+
+    def finish(self, rows: int):
+        self._active -= 1
+        self.items += 1
+        self.rows += rows
+        if self._active == 0:
+            self.busy_s += time.time() - self._busy_since
+
+    def __str__(self) -> str:
+        rows_per_s = self.rows / max(self.busy_s, 1e-6)
+        return (
+            f"{self.name}: {self.items} items, {self.rows} rows "
+            f"in {self.busy_s:.1f}s busy ({rows_per_s:,.0f} rows/s)"
+        )
+
+
+class BuildParser:
+    """Parses build directories on a process pool.
+
+    Every `bazel_log.*` file is its own task, so one large job directory is
+    spread over all workers as well. With a single worker everything is
+    parsed inline, which is handy for debugging.
+
+    With `metadata`, the tags and target kind of every configured target
+    are recorded in the index, and the workers skip decoding the events the
+    index already held when the pool started.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        metadata: Optional[TestMetadataIndex] = None,
+    ) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.metadata = metadata
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._known_configs: Optional[Dict[str, TargetConfig]] = None
+
+    @property
+    def known_configs(self) -> Dict[str, TargetConfig]:
+        if self._known_configs is None:
+            self._known_configs = (
+                self.metadata.known_configs() if self.metadata is not None else {}
+            )
+        return self._known_configs
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Don't fork a process that runs an event loop and helper threads.
+            self._pool = ProcessPoolExecutor(
+                self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.known_configs,),
+            )
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self) -> "BuildParser":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _prepare(
+        self, build_dirs: Iterable[Path], cache_dir: Optional[Path]
+    ) -> Tuple[List[Union[TestResultTable, _PendingBuild]], List[TargetConfig]]:
+        """Returns cached builds as is, and the builds that still need parsing.
+
+        Also returns the target configs of the cached builds, for the index.
+        """
+        entries: List[Union[TestResultTable, _PendingBuild]] = []
+        cached_configs: List[TargetConfig] = []
+        for build_dir in build_dirs:
+            cache_file = None
+            fingerprint = ""
+            if cache_dir is not None:
+                cache_file = cache_dir / f"{build_dir.name}.bin"
+                fingerprint = _job_fingerprint(build_dir)
+                cached = _load_cached_job(cache_file, fingerprint)
+                if cached is not None and self.metadata is not None:
+                    configs = _load_cached_configs(cache_file, fingerprint)
+                    if configs is None:
+                        # Parse again rather than leave the index without them.
+                        cached = None
+                    else:
+                        cached_configs.extend(configs)
+                if cached is not None:
+                    entries.append(cached)
+                    continue
+
+            build = _read_build_metadata(build_dir)
+            if build is not None:
+                entries.append(
+                    _PendingBuild(build, _bazel_logs(build_dir), cache_file, fingerprint)
+                )
+        return entries, cached_configs
+
+    def _finish(
+        self,
+        pending: _PendingBuild,
+        parsed_logs: List[Tuple[TestResultTable, List[TargetConfig]]],
+    ) -> TestResultTable:
+        if self.metadata is not None:
+            for _, configs in parsed_logs:
+                self.metadata.add_configs(configs)
+        table = _assemble_build(pending.build, [table for table, _ in parsed_logs])
+        if pending.cache_file is not None:
+            _store_cached_job(
+                pending.cache_file,
+                pending.fingerprint,
+                table,
+                [config for _, configs in parsed_logs for config in configs],
+            )
+        return table
+
+    def _parse_inline(self, entry: _PendingBuild) -> TestResultTable:
+        return self._finish(
+            entry, [_parse_bazel_log(log, self.known_configs) for log in entry.logs]
+        )
+
+    async def parse_builds(
+        self, build_dirs: Iterable[Path], cache_dir: Optional[Path] = None
+    ) -> TestResultTable:
+        """Results of all `build_dirs`, in order, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        build_dirs = list(build_dirs)
+        entries, cached_configs = await loop.run_in_executor(
+            None, self._prepare, build_dirs, cache_dir
+        )
+        if self.metadata is not None:
+            self.metadata.add_configs(cached_configs)
+        if self.max_workers == 1:
+            return await loop.run_in_executor(
+                None,
+                lambda: TestResultTable.concat(
+                    entry
+                    if isinstance(entry, TestResultTable)
+                    else self._parse_inline(entry)
+                    for entry in entries
+                ),
+            )
+
+        async def parse(entry):
+            if isinstance(entry, TestResultTable):
+                return entry
+            parsed_logs = await asyncio.gather(
+                *[
+                    asyncio.wrap_future(self.pool.submit(_parse_log_task, log))
+                    for log in entry.logs
+                ]
+            )
+            return self._finish(entry, parsed_logs)
+
+        return TestResultTable.concat(
+            await asyncio.gather(*[parse(entry) for entry in entries])
+        )
+
+
+class ParseStage:
+    """Pipeline stage between downloads and the process pool.
+
+    Downloaded commit directories are handed over through a bounded queue
+    and parsed by `BuildParser` while the event loop keeps downloading; once
+    `max_pending` commits wait for a parser, `submit` applies backpressure.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: int = 8,
+        metadata: Optional[TestMetadataIndex] = None,
+    ):
+        self.parser = BuildParser(max_workers, metadata)
+        self.stats = StageStats("parse")
+        self._queue: "asyncio.Queue" = asyncio.Queue(max_pending)
+        self._consumers: List[asyncio.Task] = []
+
+    async def __aenter__(self) -> "ParseStage":
+        self._consumers = [
+            asyncio.create_task(self._consume())
+            for _ in range(self.parser.max_workers)
+        ]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        self.parser.shutdown()
+
+    async def submit(
+        self, build_dirs: Iterable[Path], cache_dir: Optional[Path] = None
+    ) -> TestResultTable:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(build_dirs), cache_dir, future))
+        return await future
+
+    async def _consume(self):
+        while True:
+            build_dirs, cache_dir, future = await self._queue.get()
+            self.stats.start()
+            builds = None
+            try:
+                builds = await self.parser.parse_builds(build_dirs, cache_dir)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(builds)
+            finally:
+                self.stats.finish(len(builds) if builds is not None else 0)
+                self._queue.task_done()
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_STOP = object()
+_ABORT = object()
+
+
+class _Aborted(Exception):
+    pass
+
+
+class WriteStage:
+    """Pipeline stage owning the ResultsDBWriter on a dedicated thread.
+
+    sqlite connections belong to the thread that opened them, so the writer
+    is created, bulk loaded and closed on the stage's thread while the event
+    loop keeps fetching and the process pool keeps parsing. Writes are
+    applied in submission order; once `max_pending` of them are queued,
+    `submit` applies backpressure. Leaving the block with an exception rolls
+    the whole load back.
+    """
+
+    def __init__(
+        self, make_writer: Callable[[], ResultsDBWriter], max_pending: int = 4
+    ) -> None:
+        self.stats = StageStats("write")
+        self._make_writer = make_writer
+        self._queue: "queue.Queue" = queue.Queue()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+    async def __aenter__(self) -> "WriteStage":
+        self._loop = asyncio.get_running_loop()
+        ready = self._loop.create_future()
+        self._finished = self._loop.create_future()
+        threading.Thread(
+            target=self._run, args=(ready,), name="results-db-writer", daemon=True
+        ).start()
+        await ready
+        return self
+
+    async def __aexit__(self, exc_type, *exc_info):
+        self._put(_STOP if exc_type is None else _ABORT)
+        await self._finished
+        if exc_type is None and self._error is not None:
+            raise self._error
+
+    def _put(self, item) -> bool:
+        with self._lock:
+            if self._closed:
+                return False
+            self._queue.put(item)
+            return True
+
+    async def submit(self, fn: Callable[[ResultsDBWriter], Any]) -> asyncio.Future:
+        """Queues `fn(writer)` and returns a future of its result."""
+        await self._slots.acquire()
+        future = self._loop.create_future()
+        future.add_done_callback(lambda _: self._slots.release())
+        if not self._put((fn, future)):
+            future.cancel()
+            raise RuntimeError("results DB writer stopped") from self._error
+        return future
+
+    def _run(self, ready: asyncio.Future):
+        call = self._loop.call_soon_threadsafe
+        try:
+            db = self._make_writer()
+        except BaseException as e:
+            self._error = e
+            self._close()
+            call(_resolve, ready, None, e)
+            return
+        call(_resolve, ready)
+
+        try:
+            with db.bulk_load():
+                while True:
+                    item = self._queue.get()
+                    if item is _STOP:
+                        break
+                    if item is _ABORT:
+                        raise _Aborted()
+                    fn, future = item
+                    rows_written = db.rows_written
+                    self.stats.start()
+                    try:
+                        result = fn(db)
+                    except BaseException as e:
+                        call(_resolve, future, None, e)
+                        raise
+                    finally:
+                        self.stats.finish(db.rows_written - rows_written)
+                    call(_resolve, future, result)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            self._error = e
+        finally:
+            db.table.close()
+            self._close()
+            call(_resolve, self._finished)
+
+    def _close(self):
+        with self._lock:
+            self._closed = True
+        while not self._queue.empty():
+            item = self._queue.get()
+            if isinstance(item, tuple):
+                self._loop.call_soon_threadsafe(
+                    _resolve,
+                    item[1],
+                    None,
+                    RuntimeError("results DB writer stopped"),
+                )
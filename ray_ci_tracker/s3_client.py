@@ -0,0 +1,153 @@
+import asyncio
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import quote, urlencode
+
+import aiofiles
+import botocore.session
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+from ray_ci_tracker.common import retry
+from ray_ci_tracker.http_client import HTTPClientPool
+
+_S3_XML_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+_DEFAULT_REGION = "us-west-2"
+
+
+@dataclass
+class S3Object:
+    key: str
+    size: int
+    etag: str
+    last_modified: str
+
+
+class AsyncS3Client:
+    """Minimal in-process S3 client: ListObjectsV2 and streaming GetObject.
+
+    Requests are SigV4-signed with botocore's credential chain (or sent
+    unsigned when there are no credentials) and go through the shared
+    `HTTPClientPool`. `max_concurrency` bounds in-flight GETs across every
+    caller. Passing `endpoint_url` (or setting `AWS_ENDPOINT_URL`) switches to
+    path-style addressing so any S3-compatible server can stand in for AWS.
+    """
+
+    def __init__(
+        self,
+        clients: HTTPClientPool,
+        *,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        max_concurrency: int = 20,
+    ) -> None:
+        session = botocore.session.get_session()
+        self.region = region or session.get_config_variable("region") or _DEFAULT_REGION
+        self.endpoint_url = (
+            endpoint_url
+            or os.environ.get("AWS_ENDPOINT_URL_S3")
+            or os.environ.get("AWS_ENDPOINT_URL")
+        )
+        self._credentials = session.get_credentials()
+        self._clients = clients
+        self._limiter = asyncio.Semaphore(max_concurrency)
+
+    def _bucket_url(self, bucket: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{bucket}"
+        return f"https://{bucket}.s3.{self.region}.amazonaws.com"
+
+    def _signed_headers(self, method: str, url: str) -> Dict[str, str]:
+        if self._credentials is None:
+            return {}
+        request = AWSRequest(method=method, url=url)
+        S3SigV4Auth(
+            self._credentials.get_frozen_credentials(), "s3", self.region
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    @retry
+    async def _get(self, url: str):
+        resp = await self._clients.get(url).get(
+            url, headers=self._signed_headers("GET", url)
+        )
+        resp.raise_for_status()
+        return resp
+
+    async def list_objects(self, bucket: str, prefix: str) -> AsyncIterator[S3Object]:
+        continuation_token = None
+        while True:
+            params = {"list-type": "2", "prefix": prefix}
+            if continuation_token:
+                params["continuation-token"] = continuation_token
+            query = urlencode(sorted(params.items()), quote_via=quote, safe="")
+            async with self._limiter:
+                resp = await self._get(f"{self._bucket_url(bucket)}/?{query}")
+
+            root = ET.fromstring(resp.content)
+            for item in root.iter(f"{_S3_XML_NS}Contents"):
+                yield S3Object(
+                    key=item.findtext(f"{_S3_XML_NS}Key", ""),
+                    size=int(item.findtext(f"{_S3_XML_NS}Size", "0")),
+                    etag=item.findtext(f"{_S3_XML_NS}ETag", "").strip('"'),
+                    last_modified=item.findtext(f"{_S3_XML_NS}LastModified", ""),
+                )
+
+            if root.findtext(f"{_S3_XML_NS}IsTruncated") != "true":
+                return
+            continuation_token = root.findtext(f"{_S3_XML_NS}NextContinuationToken")
+
+    def _object_url(self, bucket: str, key: str) -> str:
+        return f"{self._bucket_url(bucket)}/{quote(key, safe='/~')}"
+
+    async def get_bytes(self, bucket: str, key: str) -> bytes:
+        async with self._limiter:
+            resp = await self._get(self._object_url(bucket, key))
+        return resp.content
+
+    @retry
+    async def download(self, bucket: str, key: str, path: Path):
+        url = self._object_url(bucket, key)
+        tmp_path = path.with_name(path.name + ".part")
+        async with self._limiter:
+            async with self._clients.get(url).stream(
+                "GET", url, headers=self._signed_headers("GET", url)
+            ) as resp:
+                resp.raise_for_status()
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes():
+                        await f.write(chunk)
+        os.replace(tmp_path, path)
+
+    async def sync(
+        self,
+        bucket: str,
+        prefix: str,
+        download_dir: Path,
+        max_object_size: Optional[int] = None,
+    ) -> List[S3Object]:
+        prefix = prefix.rstrip("/") + "/"
+        objects = [obj async for obj in self.list_objects(bucket, prefix)]
+
+        to_download = []
+        for obj in objects:
+            if obj.key.endswith("/"):
+                continue
+            if max_object_size is not None and obj.size > max_object_size:
+                print(f"Skipping {obj.key} because it's too large: {obj.size}")
+                continue
+            path = Path(download_dir) / obj.key[len(prefix):]
+            # Same as `aws s3 sync`: objects already on disk with the listed
+            # size are considered up to date.
+            if path.exists() and path.stat().st_size == obj.size:
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            to_download.append((obj.key, path))
+
+        await asyncio.gather(
+            *[self.download(bucket, key, path) for key, path in to_download]
+        )
+        return objects
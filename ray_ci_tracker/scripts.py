@@ -1,15 +1,33 @@
+import asyncio
+import functools
 from pathlib import Path
+import time
 
 import boto3
 import click
 import ujson as json
 
+from ray_ci_tracker.cache_format import table_digest
+from ray_ci_tracker.columnar import TestResultTable
 from ray_ci_tracker.common import run_as_sync
 from ray_ci_tracker.data_source.buildkite_release import BuildkiteReleaseSource
 from ray_ci_tracker.data_source.github import GithubDataSource
 from ray_ci_tracker.data_source.s3 import S3DataSource
+from ray_ci_tracker.data_source.test_state import TestStateSource
 from ray_ci_tracker.database import ResultsDBReader, ResultsDBWriter
-from ray_ci_tracker.interfaces import SiteDisplayRoot, SiteFailedTest, SiteWeeklyGreenMetric
+from ray_ci_tracker.http_client import HTTPClientPool
+from ray_ci_tracker.manifest import SyncManifest
+from ray_ci_tracker.parallel import ParseStage, WriteStage
+from ray_ci_tracker.s3_client import AsyncS3Client
+from ray_ci_tracker.shard import ShardStage
+from ray_ci_tracker.status_matrix import StatusMatrix, write_status_matrix
+from ray_ci_tracker.test_metadata import TestMetadataIndex
+from ray_ci_tracker.interfaces import (
+    GHCommit,
+    SiteDisplayRoot,
+    SiteFailedTest,
+    SiteWeeklyGreenMetric,
+)
 
 
 AWS_ROLE = "arn:aws:iam::029272617770:role/go-flaky-dashboard"
@@ -23,6 +41,15 @@ AWS_WEEKLY_GREEN_METRIC_PREFIX = "ray_weekly_green_metric/blocker_"
 @click.option("--cached-buildkite/--no-cached-buildkite", default=True)
 @click.option("--cached-buildkite-release/--no-cached-buildkite-release", default=True)
 @click.option("--cached-gha/--no-cached-gha", default=True)
+@click.option("--http2/--no-http2", default=False)
+@click.option("--max-connections", default=20, show_default=True)
+@click.option("--s3-endpoint-url", envvar="AWS_ENDPOINT_URL", default=None)
+@click.option(
+    "--parse-workers",
+    type=int,
+    default=None,
+    help="Processes used to parse bazel event logs (default: one per core).",
+)
 @click.pass_context
 def cli(
     ctx,
@@ -31,6 +58,10 @@ def cli(
     cached_buildkite: bool,
     cached_buildkite_release: bool,
     cached_gha: bool,
+    http2: bool,
+    max_connections: int,
+    s3_endpoint_url: str,
+    parse_workers: int,
 ):
     ctx.ensure_object(dict)
     ctx.obj["cached_github"] = cached_github
@@ -38,63 +69,195 @@ def cli(
     ctx.obj["cached_buildkite"] = cached_buildkite
     ctx.obj["cached_buildkite_release"] = cached_buildkite
     ctx.obj["cached_gha"] = cached_gha
+    ctx.obj["http2"] = http2
+    ctx.obj["max_connections"] = max_connections
+    ctx.obj["s3_endpoint_url"] = s3_endpoint_url
+    ctx.obj["parse_workers"] = parse_workers
+
+
+def _make_client_pool(ctx) -> HTTPClientPool:
+    return HTTPClientPool(
+        http2=ctx.obj["http2"], max_connections=ctx.obj["max_connections"]
+    )
+
+
+def _make_s3_client(ctx, clients: HTTPClientPool) -> AsyncS3Client:
+    return AsyncS3Client(
+        clients,
+        endpoint_url=ctx.obj["s3_endpoint_url"],
+        max_concurrency=ctx.obj["max_connections"],
+    )
 
 
 @cli.command("download")
 @click.argument("cache-dir")
+@click.option(
+    "--incremental/--no-incremental",
+    default=True,
+    help="Only sync commits that are new or whose CI data is not final yet.",
+)
+@click.option(
+    "--final-after-hours",
+    default=6.0,
+    show_default=True,
+    help="Age after which a commit with a stable S3 listing is considered final.",
+)
 @click.pass_context
 @run_as_sync
-async def download(ctx, cache_dir):
+async def download(ctx, cache_dir, incremental, final_after_hours):
     cache_path = Path(cache_dir)
     cache_path.mkdir(exist_ok=True)
+    test_metadata = TestMetadataIndex.load(cache_path)
 
-    print("🐙 Fetching Commits from Github")
-    commits = await GithubDataSource.fetch_commits(cache_path, ctx.obj["cached_github"])
+    async with _make_client_pool(ctx) as clients, ParseStage(
+        ctx.obj["parse_workers"], metadata=test_metadata
+    ) as parse_stage:
+        s3_client = _make_s3_client(ctx, clients)
 
-    print("💻 Downloading Files from S3")
-    await S3DataSource.fetch_all(
-        cache_path, ctx.obj["cached_s3"], commits
-    )
-
-    if False:
-        # Not working anymore..
-        print("💻 Downloading Files from Buildkite Release Tests")
-        await BuildkiteReleaseSource.fetch_all(
-            cache_path, ctx.obj["cached_buildkite_release"], commits
+        print("🐙 Fetching Commits from Github")
+        commits = await GithubDataSource.fetch_commits(
+            cache_path, ctx.obj["cached_github"], clients
         )
 
+        manifest = None
+        if incremental:
+            manifest = SyncManifest.load(cache_path, final_after_hours * 3600)
+            manifest.prune(commits)
+            print(
+                f"💻 Syncing {sum(manifest.needs_sync(c) for c in commits)}"
+                f"/{len(commits)} commits not yet final"
+            )
+
+        print("💻 Downloading Files from S3")
+        # Results are only cached here, don't hold on to them.
+        async for commit, results in S3DataSource.iter_by_commit(
+            cache_path,
+            ctx.obj["cached_s3"],
+            commits,
+            s3_client,
+            parse_stage,
+            manifest,
+        ):
+            test_metadata.update_from_table(commit, results)
+        test_metadata.save()
+        if manifest is not None:
+            manifest.save()
+            print("📒 Sync manifest:", manifest.summary())
+
+        print("🚩 Prefetching flaky test states")
+        await TestStateSource.fetch_all(cache_path, False, s3_client)
+
+        if False:
+            # Not working anymore..
+            print("💻 Downloading Files from Buildkite Release Tests")
+            await BuildkiteReleaseSource.fetch_all(
+                cache_path, ctx.obj["cached_buildkite_release"], commits, clients
+            )
+
 
 @cli.command("etl")
 @click.argument("cache_dir")
 @click.argument("db_path")
+@click.option(
+    "--incremental/--no-incremental",
+    default=True,
+    help="Update an existing DB in place, only rewriting commits whose data changed.",
+)
+@click.option(
+    "--sharded/--no-sharded",
+    default=False,
+    help="Build a SQLite shard per commit on the parse workers and merge them.",
+)
 @click.pass_context
 @run_as_sync
-async def etl_process(ctx, cache_dir, db_path):
+async def etl_process(ctx, cache_dir, db_path, incremental, sharded):
     print("✍️ Writing Data")
-    db = ResultsDBWriter(db_path, wipe=True)
     cache_path = Path(cache_dir)
+    test_metadata = TestMetadataIndex.load(cache_path)
 
-    print("[1/n] Writing commits")
-    commits = await GithubDataSource.fetch_commits(cache_path, ctx.obj["cached_github"])
-    db.write_commits(commits)
-
-    print("[1/n] Writing S3 data")
-    build_events = await S3DataSource.fetch_all(
-        cache_path, ctx.obj["cached_s3"], commits
-    )
-    db.write_build_results(build_events)
-    del build_events
-    
-    if False:
-        print("[1/n] Writing Release Test data")
-        buildkite_release_result = await BuildkiteReleaseSource.fetch_all(
-            cache_path, ctx.obj["cached_buildkite_release"], commits
+    async with _make_client_pool(ctx) as clients, ParseStage(
+        ctx.obj["parse_workers"], metadata=test_metadata
+    ) as parse_stage:
+        s3_client = _make_s3_client(ctx, clients)
+        test_state = await TestStateSource.fetch_all(cache_path, True, s3_client)
+        commits = await GithubDataSource.fetch_commits(
+            cache_path, ctx.obj["cached_github"], clients
         )
-        buildkite_release_result = list(
-            filter(lambda r: r is not None, buildkite_release_result)
+
+        # Parsing runs on the process pool and inserts on the writer thread,
+        # so the two overlap instead of adding up.
+        start = time.time()
+        async with WriteStage(
+            functools.partial(
+                ResultsDBWriter,
+                db_path,
+                wipe=not incremental,
+                test_state=test_state,
+                test_owners=test_metadata.owners(),
+            )
+        ) as writer:
+            print("[1/n] Writing commits")
+            await (await writer.submit(lambda db: db.write_commits(commits)))
+
+            print("[1/n] Writing S3 data")
+            shards = None
+            if sharded:
+                shards = ShardStage(cache_path, parse_stage.parser.pool, writer)
+            writes = []
+            async for commit, results in S3DataSource.iter_by_commit(
+                cache_path, ctx.obj["cached_s3"], commits, s3_client, parse_stage
+            ):
+                test_metadata.update_from_table(commit, results)
+                if shards is not None:
+                    await shards.add(commit, results)
+                    continue
+                writes.append(
+                    await writer.submit(
+                        functools.partial(_write_commit, commit=commit, results=results)
+                    )
+                )
+            if shards is not None:
+                num_written = await shards.finish()
+            else:
+                num_written = sum(await asyncio.gather(*writes))
+            print(f"  Rewrote {num_written}/{len(commits)} commits whose data changed")
+
+            # Tests first seen in this run were written with the owner of
+            # their first result; settle them on the newest tagged one.
+            owners = test_metadata.owners()
+            await (await writer.submit(lambda db: db.set_test_owners(owners)))
+            test_metadata.save()
+
+            if False:
+                print("[1/n] Writing Release Test data")
+                buildkite_release_result = await BuildkiteReleaseSource.fetch_all(
+                    cache_path, ctx.obj["cached_buildkite_release"], commits, clients
+                )
+                buildkite_release_result = list(
+                    filter(lambda r: r is not None, buildkite_release_result)
+                )
+                await (
+                    await writer.submit(
+                        lambda db: db.write_build_results(buildkite_release_result)
+                    )
+                )
+
+        matrix_start = time.time()
+        num_tests, num_commits = write_status_matrix(db_path)
+        print(
+            f"🧮 Wrote {num_tests} tests x {num_commits} commits status matrix "
+            f"in {time.time() - matrix_start:.1f}s"
         )
-        db.write_build_results(buildkite_release_result)
-        del buildkite_release_result
+
+        print(f"⏱ {parse_stage.stats}")
+        if shards is not None:
+            print(f"⏱ {shards.stats}, {shards.num_reused} shards reused")
+        print(f"⏱ {writer.stats}")
+        print(f"⏱ total: {time.time() - start:.1f}s")
+
+
+def _write_commit(db: ResultsDBWriter, commit: GHCommit, results: TestResultTable):
+    return db.write_commit_results(commit.sha, results, table_digest(results))
 
 
 def get_weekly_green_metric():
@@ -142,19 +305,24 @@ def get_weekly_green_metric():
 @click.argument("frontend_json_path")
 def perform_analysis(db_path, frontend_json_path):
     print("🔮 Analyzing Data")
-    db = ResultsDBReader(db_path)
+    db = ResultsDBReader(db_path, StatusMatrix.load(db_path))
 
-    failed_tests = db.list_tests_ordered()
+    test_names = [test_name for test_name, _ in db.list_tests_ordered()]
+    commit_tooltips = db.get_all_commit_tooltips(test_names)
+    travis_links = db.get_all_travis_links(test_names)
+    build_time_stats = db.get_all_recent_build_time_stats(test_names)
+    marked_flaky_statuses = db.get_all_marked_flaky_statuses(test_names)
+    test_owners = db.get_all_test_owners(test_names)
     data_to_display = [
         SiteFailedTest(
             name=test_name,
-            status_segment_bar=db.get_commit_tooltips(test_name),
-            travis_links=db.get_travis_link(test_name),
-            build_time_stats=db.get_recent_build_time_stats(test_name),
-            is_labeled_flaky=db.get_marked_flaky_status(test_name),
-            owner=db.get_test_owner(test_name),
+            status_segment_bar=commit_tooltips[test_name],
+            travis_links=travis_links[test_name],
+            build_time_stats=build_time_stats[test_name],
+            is_labeled_flaky=marked_flaky_statuses[test_name],
+            owner=test_owners[test_name],
         )
-        for test_name, _ in failed_tests
+        for test_name in test_names
     ]
     root_display = SiteDisplayRoot(
         failed_tests=data_to_display,
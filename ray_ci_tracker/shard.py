@@ -0,0 +1,114 @@
+import asyncio
+import functools
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from ray_ci_tracker.cache_format import decode_table, encode_table
+from ray_ci_tracker.columnar import TestResultTable
+from ray_ci_tracker.database import SCHEMA_VERSION, ResultsDBWriter
+from ray_ci_tracker.interfaces import GHCommit
+from ray_ci_tracker.parallel import StageStats, WriteStage
+
+
+def shard_path(cache_path: Path, sha: str) -> Path:
+    return cache_path / f"bazel_cached/{sha}/shard.db"
+
+
+def read_shard_version(path: Path, sha: str) -> Optional[str]:
+    """Data version of a shard, None if it is missing or of another schema."""
+    if not path.exists():
+        return None
+    db = sqlite3.connect(path)
+    try:
+        if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            return None
+        row = db.execute(
+            "SELECT data_version FROM commits WHERE sha = (?)", (sha,)
+        ).fetchone()
+        return row[0] if row else None
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        db.close()
+
+
+def build_shard(path: Path, commit: GHCommit, data: bytes, version: str):
+    """Writes the results of one commit into a results DB of its own.
+
+    Runs in a worker process; `data` is the table in the cache format, which
+    is much cheaper to send over than a pickled table.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    db = ResultsDBWriter(str(tmp_path))
+    db.write_commits([commit])
+    db.write_commit_results(commit.sha, decode_table(data), version)
+    db.table.close()
+    os.replace(tmp_path, path)
+
+
+class ShardStage:
+    """Builds one SQLite shard per commit on the process pool and merges the
+    shards into the results DB owned by `writer`.
+
+    Shards are kept in the cache dir and only rebuilt when the commit's
+    results changed, so repeated runs just merge the existing ones.
+    """
+
+    def __init__(
+        self,
+        cache_path: Path,
+        pool: ProcessPoolExecutor,
+        writer: WriteStage,
+        max_pending: int = 8,
+    ) -> None:
+        self.cache_path = cache_path
+        self.pool = pool
+        self.writer = writer
+        self.stats = StageStats("shard")
+        self.num_reused = 0
+        self._slots = asyncio.Semaphore(max_pending)
+        self._merges: List[asyncio.Task] = []
+
+    async def add(self, commit: GHCommit, results: TestResultTable):
+        await self._slots.acquire()
+        self._merges.append(asyncio.create_task(self._build_and_merge(commit, results)))
+
+    async def finish(self) -> int:
+        """Waits for all merges, returns the number of commits rewritten."""
+        return sum(await asyncio.gather(*self._merges))
+
+    async def _build_and_merge(self, commit: GHCommit, results: TestResultTable):
+        try:
+            data = encode_table(results)
+            # Same as `table_digest`, so shards and direct writes agree.
+            version = hashlib.sha1(data).hexdigest()
+            path = shard_path(self.cache_path, commit.sha)
+            if read_shard_version(path, commit.sha) == version:
+                self.num_reused += 1
+            else:
+                self.stats.start()
+                try:
+                    await asyncio.wrap_future(
+                        self.pool.submit(build_shard, path, commit, data, version)
+                    )
+                finally:
+                    self.stats.finish(len(results))
+        finally:
+            self._slots.release()
+        return await (
+            await self.writer.submit(
+                functools.partial(
+                    ResultsDBWriter.merge_commit_shard,
+                    sha=commit.sha,
+                    shard_path=str(path),
+                    version=version,
+                )
+            )
+        )
@@ -0,0 +1,337 @@
+import os
+import shutil
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dataclasses_json import DataClassJsonMixin
+
+from ray_ci_tracker.database import FAILED, FLAKY, PASSED
+from ray_ci_tracker.interfaces import SiteCommitTooltip
+
+# Dense per-(test, commit) result counts written next to the results DB.
+# The directory holds one .npy file per array, which `np.load` memory maps,
+# and an index.json naming the rows and columns:
+#
+#   counts:           uint32 (4, tests, commits), planes indexed by NUM_*
+#   unlabeled_counts: same, only results of tests not labeled flaky
+#   duration_s:       float64 (tests, commits), total duration of the results
+#
+# and per commit bitsets over the tests (bit i of a row is test i, packed
+# with np.packbits), for green rate queries under any filter:
+#
+#   ran_bits, failed_bits:                     uint8 (commits, ceil(tests / 8))
+#   unlabeled_ran_bits, unlabeled_failed_bits: same, for unlabeled_counts
+#
+# Tests are sorted by name and commits by idx, so the commits within the
+# last N are a prefix of the columns.
+
+NUM_RUNS, NUM_FAILED, NUM_FLAKY, NUM_PASSED = range(4)
+
+
+@dataclass
+class MatrixTest(DataClassJsonMixin):
+    name: str
+    owner: str
+    os: str
+    is_staging: bool
+    # Whether any of its results was labeled flaky.
+    is_flaky: bool = False
+
+
+@dataclass
+class MatrixCommit(DataClassJsonMixin):
+    sha: str
+    idx: int
+    message: str
+    url: str
+    avatar_url: str
+
+
+@dataclass
+class MatrixIndex(DataClassJsonMixin):
+    tests: List[MatrixTest]
+    commits: List[MatrixCommit]
+    # Size and mtime of the results DB the matrix was built from.
+    source_stat: Tuple[int, int]
+
+
+def matrix_path(db_path) -> Path:
+    return Path(db_path).with_suffix(".matrix")
+
+
+def _source_stat(db_path) -> Tuple[int, int]:
+    stat = os.stat(db_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_status_matrix(db_path) -> Tuple[int, int]:
+    """Builds the matrix of the DB at `db_path`, returns its (tests, commits)."""
+    db = sqlite3.connect(db_path)
+    try:
+        tests = db.execute(
+            """
+            SELECT tests.id, tests.name, owners.name,
+                MIN(jobs.os), MAX(results.is_staging_test),
+                MAX(results.is_labeled_flaky OR tests.is_flaky)
+            FROM tests, owners, results, jobs
+            WHERE tests.owner_id == owners.id
+            AND results.test_id == tests.id
+            AND results.job_id == jobs.id
+            GROUP BY tests.id
+            ORDER BY tests.name
+            """
+        ).fetchall()
+        commits = db.execute(
+            "SELECT id, sha, idx, message, url, avatar_url FROM commits ORDER BY idx"
+        ).fetchall()
+        cells = np.fromiter(
+            db.execute(
+                """
+                SELECT test_id, commit_id,
+                    COUNT(*), SUM(status_id == :failed),
+                    SUM(status_id == :flaky), SUM(status_id == :passed),
+                    SUM(unlabeled), SUM(unlabeled AND status_id == :failed),
+                    SUM(unlabeled AND status_id == :flaky),
+                    SUM(unlabeled AND status_id == :passed),
+                    TOTAL(duration_s)
+                FROM (
+                    SELECT results.*,
+                        NOT (results.is_labeled_flaky OR tests.is_flaky) AS unlabeled
+                    FROM results, tests
+                    WHERE results.test_id == tests.id
+                    AND results.commit_id IS NOT NULL
+                )
+                GROUP BY test_id, commit_id
+                """,
+                {"failed": FAILED, "flaky": FLAKY, "passed": PASSED},
+            ),
+            dtype=[("test_id", np.int64), ("commit_id", np.int64)]
+            + [(f"count_{i}", np.uint32) for i in range(8)]
+            + [("duration_s", np.float64)],
+        )
+    finally:
+        db.close()
+
+    def positions(ids: List[int], keys: np.ndarray) -> np.ndarray:
+        """Position of every key in `ids`, -1 for keys that are not in it."""
+        size = max(max(ids, default=0), int(keys.max(initial=0))) + 1
+        lookup = np.full(size, -1, dtype=np.int64)
+        lookup[ids] = np.arange(len(ids))
+        return lookup[keys]
+
+    rows = positions([test[0] for test in tests], cells["test_id"])
+    columns = positions([commit[0] for commit in commits], cells["commit_id"])
+    # Results whose test or commit did not make it into the matrix (e.g. a
+    # test without an owner row) have no cell to go to.
+    known = (rows >= 0) & (columns >= 0)
+    if not known.all():
+        dropped = np.count_nonzero(~known)
+        print(f"⚠️ Dropping {dropped} status cells without a test or commit")
+        rows, columns, cells = rows[known], columns[known], cells[known]
+    shape = (len(tests), len(commits))
+    counts = np.zeros((2, 4, *shape), dtype=np.uint32)
+    for i in range(8):
+        counts[i // 4, i % 4, rows, columns] = cells[f"count_{i}"]
+    duration_s = np.zeros(shape)
+    duration_s[rows, columns] = cells["duration_s"]
+
+    index = MatrixIndex(
+        tests=[
+            MatrixTest(
+                name=name,
+                owner=owner,
+                os=os_name,
+                is_staging=bool(staging),
+                is_flaky=bool(flaky),
+            )
+            for _, name, owner, os_name, staging, flaky in tests
+        ],
+        commits=[
+            MatrixCommit(sha=sha, idx=idx, message=msg, url=url, avatar_url=avatar)
+            for _, sha, idx, msg, url, avatar in commits
+        ],
+        source_stat=_source_stat(db_path),
+    )
+
+    path = matrix_path(db_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir()
+    np.save(tmp_path / "counts.npy", counts[0])
+    np.save(tmp_path / "unlabeled_counts.npy", counts[1])
+    np.save(tmp_path / "duration_s.npy", duration_s)
+    for prefix, plane_counts in [("", counts[0]), ("unlabeled_", counts[1])]:
+        for name, plane in [("ran", NUM_RUNS), ("failed", NUM_FAILED)]:
+            np.save(
+                tmp_path / f"{prefix}{name}_bits.npy",
+                np.packbits(plane_counts[plane].T > 0, axis=1),
+            )
+    with open(tmp_path / "index.json", "w") as f:
+        f.write(index.to_json())
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return shape
+
+
+class StatusMatrix:
+    """Read side of the status matrix, answering reader queries with slices."""
+
+    def __init__(self, path: Path) -> None:
+        with open(path / "index.json") as f:
+            self.index = MatrixIndex.from_json(f.read())
+        self.counts = np.load(path / "counts.npy", mmap_mode="r")
+        self.unlabeled_counts = np.load(path / "unlabeled_counts.npy", mmap_mode="r")
+        self.duration_s = np.load(path / "duration_s.npy", mmap_mode="r")
+        self.bits = {
+            name: np.load(path / f"{name}_bits.npy", mmap_mode="r")
+            for name in ["ran", "failed", "unlabeled_ran", "unlabeled_failed"]
+        }
+        self.rows: Dict[str, int] = {
+            test.name: row for row, test in enumerate(self.index.tests)
+        }
+        self.commit_idx = np.array([c.idx for c in self.index.commits], dtype=np.int64)
+        # Per test attribute bitmasks, laid out like the bitsets.
+        tests = self.index.tests
+        self.all_mask = self._mask([True] * len(tests))
+        self.staging_mask = self._mask([test.is_staging for test in tests])
+        self.flaky_mask = self._mask([test.is_flaky for test in tests])
+        self.os_masks = {
+            os_name: self._mask([test.os.lower() == os_name for test in tests])
+            for os_name in {test.os.lower() for test in tests}
+        }
+        self.owner_masks = {
+            owner: self._mask([test.owner == owner for test in tests])
+            for owner in sorted({test.owner for test in tests})
+        }
+
+    @classmethod
+    def load(cls, db_path) -> Optional["StatusMatrix"]:
+        """The matrix built from the DB at `db_path`, None if missing or stale."""
+        path = matrix_path(db_path)
+        if not (path / "index.json").exists():
+            return None
+        matrix = cls(path)
+        if tuple(matrix.index.source_stat) != _source_stat(db_path):
+            return None
+        return matrix
+
+    @classmethod
+    def load_or_build(cls, db_path) -> "StatusMatrix":
+        """Like `load`, but (re)builds the matrix when it is missing or stale."""
+        matrix = cls.load(db_path)
+        if matrix is None:
+            write_status_matrix(db_path)
+            matrix = cls(matrix_path(db_path))
+        return matrix
+
+    def columns(self, max_idx: Optional[int] = None) -> slice:
+        """Columns of the commits with `idx <= max_idx`."""
+        if max_idx is None:
+            return slice(None)
+        return slice(0, int(np.searchsorted(self.commit_idx, max_idx, side="right")))
+
+    def num_failed(self, max_idx: Optional[int] = None) -> np.ndarray:
+        """Failed results of every test over the commits with `idx <= max_idx`."""
+        return self.counts[NUM_FAILED, :, self.columns(max_idx)].sum(axis=1)
+
+    def most_recent_failure(self, max_idx: Optional[int] = None) -> np.ndarray:
+        """idx of the newest commit each test failed on, -1 if it did not."""
+        failed = self.counts[NUM_FAILED, :, self.columns(max_idx)] > 0
+        if failed.shape[1] == 0:
+            return np.full(len(failed), -1)
+        return np.where(failed.any(axis=1), self.commit_idx[failed.argmax(axis=1)], -1)
+
+    def commit_tooltips(self, test_name: str) -> List[SiteCommitTooltip]:
+        row = self.rows.get(test_name)
+        if row is None:
+            counts = np.zeros((4, len(self.index.commits)), dtype=np.uint32)
+        else:
+            counts = self.counts[:, row]
+        return [
+            SiteCommitTooltip(
+                num_failed=num_failed if num_runs else None,
+                num_flaky=num_flaky if num_runs else None,
+                num_passed=num_passed if num_runs else None,
+                message=commit.message,
+                author_avatar=commit.avatar_url,
+                commit_url=commit.url,
+            )
+            for commit, (num_runs, num_failed, num_flaky, num_passed) in zip(
+                self.index.commits, counts.T.tolist()
+            )
+        ]
+
+    @staticmethod
+    def _mask(is_set: List[bool]) -> np.ndarray:
+        return np.packbits(np.array(is_set, dtype=bool))
+
+    def test_mask(
+        self,
+        exclude_flaky_tests: bool = False,
+        exclude_staging: bool = False,
+        exclude_oses: Iterable[str] = (),
+        owner: Optional[str] = None,
+    ) -> np.ndarray:
+        """Bitmask of the tests passing a filter, to pass to `green_rate`."""
+        mask = self.all_mask.copy()
+        if exclude_flaky_tests:
+            mask &= ~self.flaky_mask
+        if exclude_staging:
+            mask &= ~self.staging_mask
+        for os_name in exclude_oses:
+            if os_name.lower() in self.os_masks:
+                mask &= ~self.os_masks[os_name.lower()]
+        if owner is not None:
+            mask &= self.owner_masks.get(owner, 0)
+        return mask
+
+    def green_rate(
+        self,
+        mask: np.ndarray,
+        exclude_flaky: bool = False,
+        max_idx: Optional[int] = None,
+    ) -> Optional[float]:
+        """Share of commits without failures of the tests in `mask`.
+
+        Only commits with results of those tests count. With `exclude_flaky`,
+        results labeled flaky are ignored, like the reader's green rates do.
+        """
+        prefix = "unlabeled_" if exclude_flaky else ""
+        columns = self.columns(max_idx)
+        has_results = (self.bits[prefix + "ran"][columns] & mask).any(axis=1)
+        num_commits = int(has_results.sum())
+        if num_commits == 0:
+            return None
+        has_failures = (self.bits[prefix + "failed"][columns] & mask).any(axis=1)
+        return int((has_results & ~has_failures).sum()) * 1.0 / num_commits
+
+    def master_green_rates(self) -> Tuple[Optional[float], Optional[float]]:
+        """Green rate of all commits, and of commits ignoring flaky and windows tests."""
+        return (
+            self.green_rate(self.test_mask(exclude_staging=True)),
+            self.green_rate(
+                self.test_mask(exclude_staging=True, exclude_oses=["windows"]),
+                exclude_flaky=True,
+            ),
+        )
+
+    def per_team_pass_rates(
+        self, max_idx: int
+    ) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]]]:
+        """Green rate per owner, and per owner ignoring flaky and windows tests."""
+        rates, rates_no_windows_no_flaky = [], []
+        for owner in self.owner_masks:
+            rate = self.green_rate(self.test_mask(owner=owner), max_idx=max_idx)
+            if rate is not None:
+                rates.append((owner, rate))
+            rate = self.green_rate(
+                self.test_mask(owner=owner, exclude_oses=["windows"]),
+                exclude_flaky=True,
+                max_idx=max_idx,
+            )
+            if rate is not None:
+                rates_no_windows_no_flaky.append((owner, rate))
+        return rates, rates_no_windows_no_flaky
@@ -0,0 +1,138 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import ujson as json
+from dataclasses_json import DataClassJsonMixin
+
+from ray_ci_tracker.columnar import TestResultTable
+from ray_ci_tracker.interfaces import GHCommit
+
+_STAGING_SUFFIX = " (staging)"
+_UNKNOWN_OWNER = "unknown"
+
+
+def _strip_staging(name: str) -> str:
+    if name.endswith(_STAGING_SUFFIX):
+        return name[: -len(_STAGING_SUFFIX)]
+    return name
+
+
+def test_label(test_name: str) -> str:
+    """`linux://python/ray:test_foo (staging)` -> `//python/ray:test_foo`."""
+    _, _, label = test_name.partition(":")
+    return _strip_staging(label)
+
+
+@dataclass
+class TargetConfig(DataClassJsonMixin):
+    """What the parser needs from a `targetConfigured` bazel event."""
+
+    label: str
+    target_kind: Optional[str]
+    # None when the event carried no tags at all.
+    tags: Optional[List[str]]
+    # sha1 of the raw event line.
+    digest: str = ""
+
+
+@dataclass
+class TestMetadata(DataClassJsonMixin):
+    owner: Optional[str] = None
+    tags: Optional[List[str]] = None
+    target_kind: Optional[str] = None
+    # Digest of the `targetConfigured` event `tags` and `target_kind` are from.
+    config_digest: Optional[str] = None
+    last_seen_sha: Optional[str] = None
+    last_seen_s: float = 0
+    # Commit time of the results `owner` was taken from.
+    owner_seen_s: float = 0
+
+
+class TestMetadataIndex:
+    """Per-test metadata persisted in the cache dir, keyed by bazel label.
+
+    Owners come from the `team:` tags of the newest commit that tagged the
+    test, so every result of a test is attributed to the same team without
+    rewriting rows after the fact. Tags and target kind are those of the
+    last `targetConfigured` event the parser saw for the test; the parser
+    skips decoding that event again while it stays unchanged. Only the latest
+    event of every label is kept, so the index grows with the number of
+    targets rather than with the number of logs.
+    """
+
+    FILE_NAME = "test_metadata.json"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.tests: Dict[str, TestMetadata] = {}
+        if path.exists():
+            with open(path) as f:
+                loaded = json.load(f)
+            self.tests = {
+                label: TestMetadata.from_dict(metadata)
+                for label, metadata in loaded.get("tests", {}).items()
+            }
+
+    @classmethod
+    def load(cls, cache_path: Path) -> "TestMetadataIndex":
+        return cls(cache_path / cls.FILE_NAME)
+
+    def _test(self, label: str) -> TestMetadata:
+        metadata = self.tests.get(label)
+        if metadata is None:
+            metadata = self.tests[label] = TestMetadata()
+        return metadata
+
+    def add_configs(self, configs: Iterable[TargetConfig]):
+        for config in configs:
+            metadata = self._test(config.label)
+            metadata.tags = config.tags
+            metadata.target_kind = config.target_kind
+            metadata.config_digest = config.digest or None
+
+    def known_configs(self) -> Dict[str, TargetConfig]:
+        """The indexed `targetConfigured` events by digest, for the parser."""
+        return {
+            metadata.config_digest: TargetConfig(
+                label, metadata.target_kind, metadata.tags, metadata.config_digest
+            )
+            for label, metadata in self.tests.items()
+            if metadata.config_digest is not None
+        }
+
+    def update_from_table(self, commit: GHCommit, table: TestResultTable):
+        strings = table.strings.strings
+        for name, owner in set(zip(table.test_name, table.test_owner)):
+            metadata = self._test(_strip_staging(strings[name]))
+            if commit.unix_time_s >= metadata.last_seen_s:
+                metadata.last_seen_sha = commit.sha
+                metadata.last_seen_s = commit.unix_time_s
+            owner = strings[owner]
+            if owner != _UNKNOWN_OWNER and (
+                metadata.owner is None or commit.unix_time_s >= metadata.owner_seen_s
+            ):
+                metadata.owner = owner
+                metadata.owner_seen_s = commit.unix_time_s
+
+    def owners(self) -> Dict[str, str]:
+        return {
+            label: metadata.owner
+            for label, metadata in self.tests.items()
+            if metadata.owner is not None
+        }
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "tests": {
+                        label: metadata.to_dict()
+                        for label, metadata in self.tests.items()
+                    }
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import requests
 from dotenv import load_dotenv
 import sys
@@ -7,6 +6,7 @@ from datetime import datetime
 import pytz
 
 from docker_checker import check_recent_commits_have_docker_build
+from ray_ci_tracker.status_matrix import StatusMatrix
 
 current_time_pacific = (
     datetime.utcnow()
@@ -21,20 +21,12 @@ if not ((9 <= current_time_pacific.hour < 17) and (current_time_pacific.weekday(
 
 load_dotenv()
 
-db = sqlite3.connect("./results.db")
-failed_tests = list(
-    db.execute(
-        """
-SELECT test_name, COUNT(*) as failed_count
-FROM test_result, commits
-WHERE test_result.sha == commits.sha
-  AND status == 'FAILED'
-  AND commits.idx <= 5
-GROUP BY test_name
-  HAVING COUNT(*) >= 3
-"""
-    )
-)
+matrix = StatusMatrix.load_or_build("./results.db")
+failed_tests = [
+    (test.name, failed_count)
+    for test, failed_count in zip(matrix.index.tests, matrix.num_failed(max_idx=5).tolist())
+    if failed_count >= 3
+]
 failed_docker_builds = check_recent_commits_have_docker_build()
 if len(failed_tests) == 0 and len(failed_docker_builds) == 0:
     print("No failed cases, skipping.")
@@ -1,28 +1,24 @@
 import os
-import sqlite3
 import requests
 from dotenv import load_dotenv
 import sys
 
+from ray_ci_tracker.status_matrix import StatusMatrix
+
 load_dotenv()
 
-db = sqlite3.connect("./results.db")
-top_failed_tests = list(
-    db.execute(
-        """
-SELECT
-  test_name,
-  MIN(commits.idx) as most_recent_failure,
-  COUNT(*) as failed_count
-FROM test_result, commits
-WHERE test_result.sha == commits.sha
-  AND status == 'FAILED'
-  AND commits.idx < 20
-GROUP BY test_name
-  HAVING COUNT(*) >= 5
-ORDER BY failed_count DESC;
-"""
-    )
+matrix = StatusMatrix.load_or_build("./results.db")
+top_failed_tests = sorted(
+    (
+        (test.name, most_recent, failed_count)
+        for test, most_recent, failed_count in zip(
+            matrix.index.tests,
+            matrix.most_recent_failure(max_idx=19).tolist(),
+            matrix.num_failed(max_idx=19).tolist(),
+        )
+        if failed_count >= 5
+    ),
+    key=lambda test: -test[2],
 )
 
 has_flaky_tests = False
@@ -0,0 +1,43 @@
+import pytest
+
+from ray_ci_tracker.cache_format import (
+    CacheFormatError,
+    decode_table,
+    encode_table,
+    read_key,
+)
+from ray_ci_tracker import columnar
+
+
+def _table() -> columnar.TestResultTable:
+    table = columnar.TestResultTable()
+    for job in range(3):
+        build = table.add_build(f"sha{job}", "url", "linux", "env", f"job{job}")
+        for i in range(30):
+            table.add_test(
+                build, f"//t:{i}", "PASSED", i * 1.5, i % 7 == 0, "core", i % 5 == 0
+            )
+    return table
+
+
+def test_round_trip():
+    table = _table()
+    data = encode_table(table, key="fingerprint")
+    assert read_key(data) == "fingerprint"
+    decoded = decode_table(data)
+    assert len(decoded) == 90
+    assert list(decoded.iter_rows()) == list(table.iter_rows())
+    assert encode_table(decoded, key="fingerprint") == data
+
+
+@pytest.mark.parametrize("size", [0, 3, 10, 100, "half", -1])
+def test_truncated(size):
+    data = encode_table(_table())
+    size = {"half": len(data) // 2, -1: len(data) - 1}.get(size, size)
+    with pytest.raises(CacheFormatError):
+        decode_table(data[:size])
+
+
+def test_trailing_bytes():
+    with pytest.raises(CacheFormatError):
+        decode_table(encode_table(_table()) + b"\0")
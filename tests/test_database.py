@@ -0,0 +1,207 @@
+import random
+import sqlite3
+
+from ray_ci_tracker import columnar
+from ray_ci_tracker.cache_format import table_digest
+from ray_ci_tracker.database import SCHEMA_VERSION, ResultsDBWriter
+from ray_ci_tracker.interfaces import GHCommit
+
+VIEW_COLUMNS = (
+    "test_name, status, build_env, os, job_url, job_id, sha, test_duration_s, "
+    "is_labeled_flaky, owner, is_staging_test"
+)
+
+
+def _commit(i: int, message: str = "message") -> GHCommit:
+    return GHCommit(f"sha{i}", 1000 + i, message, f"url{i}", "author", "avatar")
+
+
+def _results(sha: str, jobs=("job0", "job1"), tests=5, seed=0):
+    rng = random.Random(f"{sha}-{seed}")
+    table = columnar.TestResultTable()
+    for job in jobs:
+        os_name = rng.choice(["linux", "windows", "darwin"])
+        build = table.add_build(
+            sha, f"url/{sha}/{job}", os_name, "env", f"{sha}-{job}"
+        )
+        for i in range(tests):
+            table.add_test(
+                build,
+                f"//python/ray:test_{i}",
+                rng.choice(["PASSED", "FAILED", "FLAKY"]),
+                rng.random() * 10,
+                i % 4 == 0,
+                ["core", "data"][i % 2],
+                i % 3 == 0,
+            )
+    return table
+
+
+def _flat_rows(table):
+    """`table` in the layout of the old flat `test_result` table."""
+    return sorted(
+        (
+            f"{os_name}:{name}",
+            status,
+            env,
+            os_name,
+            url,
+            job_id,
+            sha,
+            duration_s,
+            flaky,
+            owner,
+            staging,
+        )
+        for (
+            sha,
+            url,
+            os_name,
+            env,
+            job_id,
+            name,
+            status,
+            duration_s,
+            flaky,
+            owner,
+            staging,
+        ) in table.iter_rows()
+    )
+
+
+def _view_rows(db: ResultsDBWriter):
+    return sorted(
+        (*row[:8], bool(row[8]), row[9], bool(row[10]))
+        for row in db.table.execute(f"SELECT {VIEW_COLUMNS} FROM test_result")
+    )
+
+
+def _write(db: ResultsDBWriter, sha: str, table) -> bool:
+    return db.write_commit_results(sha, table, table_digest(table))
+
+
+def test_view_matches_flat_rows():
+    db = ResultsDBWriter()
+    db.write_commits([_commit(0)])
+    table = _results("sha0")
+    assert _write(db, "sha0", table)
+    assert _view_rows(db) == _flat_rows(table)
+
+
+def test_write_commits_upserts_and_evicts_window():
+    db = ResultsDBWriter()
+    db.write_commits([_commit(2), _commit(1), _commit(0)])
+    for i in range(3):
+        _write(db, f"sha{i}", _results(f"sha{i}", jobs=[f"job{i}"]))
+
+    db.write_commits([_commit(3), _commit(2, "amended"), _commit(1)])
+
+    assert db.table.execute(
+        "SELECT sha, idx, message FROM commits ORDER BY idx"
+    ).fetchall() == [
+        ("sha3", 0, "message"),
+        ("sha2", 1, "amended"),
+        ("sha1", 2, "message"),
+    ]
+    shas = db.table.execute("SELECT DISTINCT sha FROM test_result").fetchall()
+    assert sorted(shas) == [("sha1",), ("sha2",)]
+    # Dimension rows only the evicted commit used are gone as well.
+    assert db.table.execute(
+        "SELECT COUNT(*) FROM jobs WHERE sha = 'sha0'"
+    ).fetchone() == (0,)
+    assert db.table.execute(
+        "SELECT COUNT(*) FROM results WHERE commit_id IS NULL"
+    ).fetchone() == (0,)
+
+
+def test_unchanged_commit_is_not_rewritten():
+    db = ResultsDBWriter()
+    db.write_commits([_commit(0)])
+    table = _results("sha0")
+    assert _write(db, "sha0", table)
+    rows_written = db.rows_written
+
+    assert not _write(db, "sha0", _results("sha0"))
+    assert db.rows_written == rows_written
+
+    changed = _results("sha0", jobs=["job1"], seed=1)
+    assert _write(db, "sha0", changed)
+    assert _view_rows(db) == _flat_rows(changed)
+    assert db.table.execute("SELECT external_id FROM jobs").fetchall() == [
+        ("sha0-job1",)
+    ]
+
+
+def test_existing_db_is_reused(tmp_path):
+    path = str(tmp_path / "results.db")
+    db = ResultsDBWriter(path)
+    db.write_commits([_commit(0)])
+    table = _results("sha0")
+    _write(db, "sha0", table)
+    db.table.close()
+
+    db = ResultsDBWriter(path, wipe=False)
+    assert _view_rows(db) == _flat_rows(table)
+    assert not _write(db, "sha0", table)
+
+
+def test_schema_version_mismatch_wipes(tmp_path):
+    path = str(tmp_path / "results.db")
+    db = ResultsDBWriter(path)
+    db.write_commits([_commit(0)])
+    _write(db, "sha0", _results("sha0"))
+    db.table.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+
+    db = ResultsDBWriter(path, wipe=False)
+    assert db.table.execute("PRAGMA user_version").fetchone() == (SCHEMA_VERSION,)
+    assert db.table.execute("SELECT COUNT(*) FROM results").fetchone() == (0,)
+    assert db.table.execute("SELECT COUNT(*) FROM commits").fetchone() == (0,)
+
+
+def test_incremental_matches_rebuild(tmp_path):
+    """Slides a window over randomly changing commits; the updated DB must
+    hold exactly what a DB rebuilt from scratch for the last window does."""
+    rng = random.Random(0)
+    path = str(tmp_path / "incremental.db")
+    versions = {}
+    for step in range(6):
+        start = step * 2
+        window = [_commit(i) for i in reversed(range(start, start + 5))]
+        for commit in window:
+            if commit.sha not in versions or rng.random() < 0.3:
+                versions[commit.sha] = rng.randrange(1000)
+
+        def tables():
+            return {
+                commit.sha: _results(
+                    commit.sha,
+                    jobs=[f"job{j}" for j in range(1 + versions[commit.sha] % 3)],
+                    seed=versions[commit.sha],
+                )
+                for commit in window
+            }
+
+        incremental = ResultsDBWriter(path, wipe=step == 0)
+        with incremental.bulk_load():
+            incremental.write_commits(window)
+            for sha, table in tables().items():
+                _write(incremental, sha, table)
+
+        rebuilt = ResultsDBWriter()
+        rebuilt.write_commits(window)
+        for sha, table in tables().items():
+            _write(rebuilt, sha, table)
+
+        for query in [
+            "SELECT sha, idx, data_version FROM commits ORDER BY sha",
+            "SELECT external_id, url, build_env, os, sha FROM jobs ORDER BY 1",
+            "SELECT name FROM tests ORDER BY 1",
+        ]:
+            assert (
+                incremental.table.execute(query).fetchall()
+                == rebuilt.table.execute(query).fetchall()
+            ), query
+        assert _view_rows(incremental) == _view_rows(rebuilt)
+        incremental.table.close()
@@ -0,0 +1,76 @@
+from ray_ci_tracker.interfaces import GHCommit
+from ray_ci_tracker.manifest import COMPLETE, MISSING, PARTIAL, SyncManifest
+from ray_ci_tracker.s3_client import S3Object
+
+HOUR_S = 3600
+COMMIT_TIME_S = 1_000_000
+
+
+def _commit(sha: str) -> GHCommit:
+    return GHCommit(sha, COMMIT_TIME_S, "message", "url", "author", "avatar")
+
+
+def _objects(*keys: str):
+    return [S3Object(key, 10, f"etag-{key}", "") for key in keys]
+
+
+def _manifest(tmp_path) -> SyncManifest:
+    return SyncManifest.load(tmp_path, final_after_s=6 * HOUR_S)
+
+
+def test_new_commit_is_partial(tmp_path):
+    manifest = _manifest(tmp_path)
+    commit = _commit("a")
+    assert manifest.needs_sync(commit, now=COMMIT_TIME_S)
+
+    state = manifest.record(commit, _objects("a/1"), now=COMMIT_TIME_S + HOUR_S)
+    assert state.state == PARTIAL
+    assert state.num_objects == 1
+    assert manifest.listing_digest("a") == state.listing_digest
+    assert manifest.needs_sync(commit, now=COMMIT_TIME_S + HOUR_S)
+
+
+def test_unchanged_listing_of_old_commit_is_complete(tmp_path):
+    manifest = _manifest(tmp_path)
+    commit = _commit("a")
+    old = COMMIT_TIME_S + 7 * HOUR_S
+
+    manifest.record(commit, _objects("a/1"), now=COMMIT_TIME_S + HOUR_S)
+    # Still uploading: the listing changed since the last check.
+    state = manifest.record(commit, _objects("a/1", "a/2"), now=old)
+    assert state.state == PARTIAL
+
+    state = manifest.record(commit, _objects("a/2", "a/1"), now=old + 1)
+    assert state.state == COMPLETE
+    assert not manifest.needs_sync(commit, now=old + 1)
+
+
+def test_young_commit_stays_partial(tmp_path):
+    manifest = _manifest(tmp_path)
+    commit = _commit("a")
+    manifest.record(commit, _objects("a/1"), now=COMMIT_TIME_S)
+    state = manifest.record(commit, _objects("a/1"), now=COMMIT_TIME_S + HOUR_S)
+    assert state.state == PARTIAL
+
+
+def test_empty_listing_is_given_up_once_old(tmp_path):
+    manifest = _manifest(tmp_path)
+    commit = _commit("a")
+
+    state = manifest.record(commit, [], now=COMMIT_TIME_S + HOUR_S)
+    assert state.state == MISSING
+    assert manifest.needs_sync(commit, now=COMMIT_TIME_S + HOUR_S)
+    assert not manifest.needs_sync(commit, now=COMMIT_TIME_S + 7 * HOUR_S)
+
+
+def test_prune_and_reload(tmp_path):
+    manifest = _manifest(tmp_path)
+    for sha in "abc":
+        manifest.record(_commit(sha), _objects(f"{sha}/1"), now=COMMIT_TIME_S)
+    manifest.prune([_commit("b"), _commit("c"), _commit("d")])
+    assert sorted(manifest.commits) == ["b", "c"]
+    manifest.save()
+
+    reloaded = _manifest(tmp_path)
+    assert reloaded.commits == manifest.commits
+    assert reloaded.summary() == {COMPLETE: 0, PARTIAL: 2, MISSING: 0}
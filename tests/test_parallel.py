@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+import ujson as json
+
+from ray_ci_tracker import common, parallel, test_metadata
+from ray_ci_tracker.parallel import BuildParser
+
+
+def _write_build(build_dir, tags):
+    build_dir.mkdir(parents=True)
+    with open(build_dir / "metadata.json", "w") as f:
+        json.dump(
+            {
+                "build_env": {
+                    "TRAVIS_OS_NAME": "linux",
+                    "TRAVIS_COMMIT": "sha0",
+                    "TRAVIS_JOB_WEB_URL": f"url/{build_dir.name}",
+                },
+                "build_config": {"config": {"env": "env"}},
+            },
+            f,
+        )
+    with open(build_dir / "bazel_log.0", "w") as f:
+        for i, test_tags in enumerate(tags):
+            label = f"//python/ray:test_{i}"
+            configured = {"targetKind": "py_test rule"}
+            if test_tags is not None:
+                configured["tag"] = test_tags
+            for event in [
+                {"id": {"targetConfigured": {"label": label}}, "configured": configured},
+                {
+                    "id": {"testSummary": {"label": label}},
+                    "testSummary": {
+                        "overallStatus": "PASSED",
+                        "totalRunDurationMillis": str(1000 * i),
+                    },
+                },
+            ]:
+                f.write(json.dumps(event) + "\n")
+
+
+def _parse(build_dirs, metadata, max_workers=1, cache_dir=None):
+    with BuildParser(max_workers, metadata) as parser:
+        return asyncio.run(parser.parse_builds(build_dirs, cache_dir))
+
+
+def _rows(table):
+    return sorted(table.iter_rows())
+
+
+TAGS = [["team:core", "flaky"], ["team:data"], None]
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_known_configs_are_not_decoded_again(tmp_path, monkeypatch, max_workers):
+    build_dirs = [tmp_path / "builds" / "job0"]
+    _write_build(build_dirs[0], TAGS)
+    metadata = test_metadata.TestMetadataIndex.load(tmp_path)
+    decoded = _parse(build_dirs, metadata)
+    metadata.save()
+
+    metadata = test_metadata.TestMetadataIndex.load(tmp_path)
+    assert len(metadata.known_configs()) == len(TAGS)
+    calls = []
+    target_config = common._target_config
+    monkeypatch.setattr(
+        common,
+        "_target_config",
+        lambda *args: calls.append(args) or target_config(*args),
+    )
+    assert _rows(_parse(build_dirs, metadata, max_workers)) == _rows(decoded)
+    if max_workers == 1:
+        # Spawned workers don't see the patch.
+        assert not calls
+    reloaded = test_metadata.TestMetadataIndex.load(tmp_path)
+    assert metadata.known_configs() == reloaded.known_configs()
+
+
+def test_changed_config_is_decoded(tmp_path):
+    build_dirs = [tmp_path / "builds" / "job0"]
+    _write_build(build_dirs[0], TAGS)
+    metadata = test_metadata.TestMetadataIndex.load(tmp_path)
+    _parse(build_dirs, metadata)
+
+    _write_build(tmp_path / "builds" / "job1", [["team:serve"], *TAGS[1:]])
+    table = _parse([tmp_path / "builds" / "job1"], metadata)
+    owners = {
+        table.strings.strings[name]: table.strings.strings[owner]
+        for name, owner in zip(table.test_name, table.test_owner)
+    }
+    assert owners == {
+        "//python/ray:test_0": "serve",
+        "//python/ray:test_1": "data",
+        "//python/ray:test_2": "unknown",
+    }
+    assert metadata.tests["//python/ray:test_0"].tags == ["team:serve"]
+    assert metadata.tests["//python/ray:test_2"].tags is None
+
+
+def test_cached_jobs_replay_configs(tmp_path, monkeypatch):
+    build_dirs = [tmp_path / "builds" / "job0"]
+    _write_build(build_dirs[0], TAGS)
+    cache_dir = tmp_path / "jobs"
+    metadata = test_metadata.TestMetadataIndex.load(tmp_path)
+    decoded = _parse(build_dirs, metadata, cache_dir=cache_dir)
+    assert (cache_dir / "job0.bin").exists()
+
+    # A fresh index is filled from the job cache, without parsing.
+    with monkeypatch.context() as patch:
+        patch.setattr(parallel, "_parse_bazel_log", None)
+        fresh = test_metadata.TestMetadataIndex.load(tmp_path / "fresh")
+        assert _rows(_parse(build_dirs, fresh, cache_dir=cache_dir)) == _rows(
+            decoded
+        )
+    assert fresh.tests == metadata.tests
+
+    # Entries cached without their configs are parsed again.
+    (cache_dir / "job0.configs.json").unlink()
+    fresh = test_metadata.TestMetadataIndex.load(tmp_path / "fresh")
+    assert _rows(_parse(build_dirs, fresh, cache_dir=cache_dir)) == _rows(decoded)
+    assert fresh.tests == metadata.tests
+    assert (cache_dir / "job0.configs.json").exists()
@@ -0,0 +1,140 @@
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from ray_ci_tracker.http_client import HTTPClientPool
+from ray_ci_tracker.s3_client import AsyncS3Client
+
+ENDPOINT = "http://s3.test"
+
+
+class _MockPool(HTTPClientPool):
+    def __init__(self, handler) -> None:
+        super().__init__()
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        return self.client
+
+
+def _listing(keys, next_token=None) -> bytes:
+    contents = "".join(
+        f"<Contents><Key>{key}</Key><Size>{size}</Size>"
+        f'<ETag>"etag-{key}"</ETag></Contents>'
+        for key, size in keys
+    )
+    truncated = "true" if next_token else "false"
+    return (
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"{contents}<IsTruncated>{truncated}</IsTruncated>"
+        + (
+            f"<NextContinuationToken>{next_token}</NextContinuationToken>"
+            if next_token
+            else ""
+        )
+        + "</ListBucketResult>"
+    ).encode()
+
+
+class _Bucket:
+    """Serves a two page listing of `objects` and their bodies."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        path = request.url.raw_path.decode()
+        if path.startswith("/bucket/?"):
+            query = parse_qs(request.url.query.decode())
+            keys = sorted(
+                (key, len(body))
+                for key, body in self.objects.items()
+                if key.startswith(query["prefix"][0])
+            )
+            if "continuation-token" not in query:
+                page = _listing(keys[:1], next_token="page 2")
+                return httpx.Response(200, content=page)
+            assert query["continuation-token"] == ["page 2"]
+            return httpx.Response(200, content=_listing(keys[1:]))
+        for key, body in self.objects.items():
+            if path == "/bucket/" + key.replace(" ", "%20").replace("+", "%2B"):
+                return httpx.Response(200, content=body)
+        return httpx.Response(404)
+
+
+def _client(handler) -> AsyncS3Client:
+    return AsyncS3Client(
+        _MockPool(handler), endpoint_url=ENDPOINT, region="us-west-2"
+    )
+
+
+async def _list(client, prefix):
+    return [obj async for obj in client.list_objects("bucket", prefix)]
+
+
+def test_list_objects_follows_continuation_token():
+    bucket = _Bucket({"p/a": b"1", "p/b": b"22", "p/c": b"333", "q/d": b"4"})
+    objects = asyncio.run(_list(_client(bucket), "p/"))
+    assert [(obj.key, obj.size, obj.etag) for obj in objects] == [
+        ("p/a", 1, "etag-p/a"),
+        ("p/b", 2, "etag-p/b"),
+        ("p/c", 3, "etag-p/c"),
+    ]
+    assert len(bucket.requests) == 2
+
+
+def test_get_bytes_quotes_key():
+    bucket = _Bucket({"p/job 1/bazel_log+x": b"events"})
+    client = _client(bucket)
+    body = asyncio.run(client.get_bytes("bucket", "p/job 1/bazel_log+x"))
+    assert body == b"events"
+    assert bucket.requests[0].url.raw_path == b"/bucket/p/job%201/bazel_log%2Bx"
+
+
+def test_get_retries_transient_errors():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503 if len(calls) < 3 else 200, content=b"ok")
+
+    assert asyncio.run(_client(handler).get_bytes("bucket", "key")) == b"ok"
+    assert len(calls) == 3
+
+
+def test_get_gives_up_after_retries():
+    with pytest.raises(httpx.HTTPStatusError):
+        client = _client(lambda _: httpx.Response(500))
+        asyncio.run(client.get_bytes("bucket", "key"))
+
+
+def test_sync_skips_large_and_up_to_date_objects(tmp_path):
+    bucket = _Bucket({"p/a/small": b"1", "p/a/large": b"x" * 10, "p/b/same": b"22"})
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "same").write_bytes(b"..")
+
+    objects = asyncio.run(
+        _client(bucket).sync("bucket", "p", tmp_path, max_object_size=5)
+    )
+
+    keys = sorted(obj.key for obj in objects)
+    assert keys == ["p/a/large", "p/a/small", "p/b/same"]
+    assert (tmp_path / "a" / "small").read_bytes() == b"1"
+    assert not (tmp_path / "a" / "large").exists()
+    assert (tmp_path / "b" / "same").read_bytes() == b".."
+    downloads = [r.url.path for r in bucket.requests if "?" not in str(r.url)]
+    assert downloads == ["/bucket/p/a/small"]
+
+
+def test_requests_are_signed(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "akid")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    bucket = _Bucket({"p/a": b"1"})
+    asyncio.run(_client(bucket).get_bytes("bucket", "p/a"))
+    authorization = bucket.requests[0].headers["Authorization"]
+    assert authorization.startswith("AWS4-HMAC-SHA256 Credential=akid/")
+    assert "/us-west-2/s3/aws4_request" in authorization
@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from ray_ci_tracker import columnar
+from ray_ci_tracker.cache_format import table_digest
+from ray_ci_tracker.data_source import test_state
+from ray_ci_tracker.database import ResultsDBReader, ResultsDBWriter
+from ray_ci_tracker.interfaces import GHCommit
+from ray_ci_tracker.status_matrix import StatusMatrix, write_status_matrix
+
+NUM_COMMITS = 12
+
+
+def _commit(i: int) -> GHCommit:
+    return GHCommit(f"sha{i}", 1000 - i, f"message {i}", f"url{i}", "author", f"a{i}")
+
+
+def _results(rng: random.Random, sha: str, oses) -> columnar.TestResultTable:
+    table = columnar.TestResultTable()
+    for os_name in oses:
+        for staging in [False, True]:
+            build = table.add_build(
+                sha, f"url/{sha}/{os_name}", os_name, "env", f"{os_name}-{staging}"
+            )
+            for i in range(12):
+                if rng.random() < 0.2:
+                    continue
+                status = rng.choices(["PASSED", "FAILED", "FLAKY"], [96, 2, 2])[0]
+                table.add_test(
+                    build,
+                    f"//python/ray:test_{i}" + (" (staging)" if staging else ""),
+                    status,
+                    rng.random() * 100,
+                    i % 5 == 0 and rng.random() < 0.8,
+                    ["core", "data", "serve"][i % 3],
+                    staging,
+                )
+    return table
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    rng = random.Random(0)
+    path = str(tmp_path_factory.mktemp("matrix") / "results.db")
+    commits = [_commit(i) for i in range(NUM_COMMITS)]
+    db = ResultsDBWriter(
+        path,
+        test_state={test_state.test_state_key("linux://python/ray:test_3"): "flaky"},
+    )
+    db.write_commits(commits)
+    for i, commit in enumerate(commits):
+        if i == 4:
+            # CI never ran on this commit.
+            continue
+        oses = ["windows"] if i == 7 else ["linux", "windows", "darwin"]
+        table = _results(rng, commit.sha, oses)
+        db.write_commit_results(commit.sha, table, table_digest(table))
+    db.table.close()
+    write_status_matrix(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def readers(db_path):
+    matrix = StatusMatrix.load(db_path)
+    assert matrix is not None
+    return ResultsDBReader(db_path), ResultsDBReader(db_path, matrix)
+
+
+def test_commit_tooltips_match_sql(readers):
+    sql, matrix = readers
+    names = [name for name, _ in sql.list_tests_ordered()] + ["linux://missing"]
+    assert matrix.get_all_commit_tooltips(names) == sql.get_all_commit_tooltips(
+        names
+    )
+    for name in names[:3]:
+        assert matrix.get_commit_tooltips(name) == sql.get_commit_tooltips(name)
+
+
+def test_green_rates_match_sql(readers):
+    sql, matrix = readers
+    assert matrix._master_green_rates() == sql._master_green_rates()
+    assert matrix.get_stats() == sql.get_stats()
+    for max_idx in [0, 5, 100]:
+        assert matrix._per_team_pass_rates(max_idx) == sql._per_team_pass_rates(
+            max_idx
+        )
+    assert matrix.get_table_stat() == sql.get_table_stat()
+
+
+@pytest.mark.parametrize("max_idx", [0, 4, 5, 19])
+def test_failure_counts_match_sql(readers, max_idx):
+    sql, matrix = readers
+    expected = {
+        name: (most_recent, count)
+        for name, most_recent, count in sql.table.execute(
+            """
+            SELECT test_name, MIN(commits.idx), COUNT(*)
+            FROM test_result, commits
+            WHERE test_result.sha == commits.sha AND status == 'FAILED'
+            AND commits.idx <= (?)
+            GROUP BY test_name
+            """,
+            (max_idx,),
+        )
+    }
+    status_matrix = matrix.matrix
+    actual = {
+        test.name: (most_recent, count)
+        for test, most_recent, count in zip(
+            status_matrix.index.tests,
+            status_matrix.most_recent_failure(max_idx).tolist(),
+            status_matrix.num_failed(max_idx).tolist(),
+        )
+        if count
+    }
+    assert actual == expected